@@ -0,0 +1,137 @@
+"""Counts the Drive API requests issued per uploaded essay and times them.
+
+Uploads run offline: the previous per-essay client and permission requests
+run against googleapiclient's HttpMockSequence, and DriveUploader against
+MockDrive, which answers by request and waits LATENCY seconds per request
+like a remote server would. Token requests are not counted: the previous
+code also fetched a new OAuth token for every essay, while DriveUploader
+fetches one per hour.
+
+Run with `python -m mdv.benchmarks.drive` from src/.
+"""
+from io import BytesIO
+from itertools import count
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import perf_counter, sleep
+import json
+import re
+import threading
+
+from googleapiclient.discovery import build
+from googleapiclient.http import HttpMockSequence, MediaIoBaseUpload
+import httplib2
+import pandas as pd
+
+from mdv.config import DriveConfig
+from mdv.drive import ANYONE_READER, DriveUploader
+
+ESSAY_COUNTS = (1, 10, 100, 500)
+ESSAY_BYTES = b'\x89PNG' + bytes(1024)
+LATENCY = 0.02
+BOUNDARY = 'batch_boundary'
+CONTENT_ID_REGEX = re.compile(r'Content-ID: <[^>]* \+ ([^>]*)>')
+
+
+class MockDrive:
+    """Thread-safe stand-in for httplib2.Http answering Drive requests."""
+
+    def __init__(self, latency: float = LATENCY):
+        self.latency = latency
+        self.request_count = 0
+        self._file_ids = count()
+        self._lock = threading.Lock()
+
+    def request(self, uri, method='GET', body=None, headers=None, **kwargs):
+        sleep(self.latency)
+        with self._lock:
+            self.request_count += 1
+        if 'uploadType=resumable' in uri:
+            upload_id = next(self._file_ids)
+            return (httplib2.Response({'status': '200',
+                                       'location': f'https://upload/{upload_id}'}),
+                    b'')
+        if uri.startswith('https://upload/'):
+            file_id = f'file-{uri.rsplit("/", 1)[-1]}'
+            return (httplib2.Response({'status': '200'}),
+                    json.dumps({'id': file_id}).encode('utf8'))
+        if 'uploadType=multipart' in uri:
+            file_id = f'file-{next(self._file_ids)}'
+            return (httplib2.Response({'status': '200'}),
+                    json.dumps({'id': file_id}).encode('utf8'))
+        if 'batch' in uri:
+            return batch_response(CONTENT_ID_REGEX.findall(body))
+        return (httplib2.Response({'status': '200'}),
+                json.dumps({'id': 'anyoneWithLink'}).encode('utf8'))
+
+
+def batch_response(request_ids: list[str]) -> tuple[httplib2.Response, bytes]:
+    parts = []
+    for request_id in request_ids:
+        parts.append(f'--{BOUNDARY}\r\n'
+                     'Content-Type: application/http\r\n'
+                     f'Content-ID: <response + {request_id}>\r\n\r\n'
+                     'HTTP/1.1 200 OK\r\n'
+                     'Content-Type: application/json\r\n\r\n'
+                     '{"id": "anyoneWithLink"}\r\n')
+    headers = {'status': '200',
+               'content-type': f'multipart/mixed; boundary="{BOUNDARY}"'}
+    body = ''.join(parts) + f'--{BOUNDARY}--'
+    return httplib2.Response(headers), body.encode('utf8')
+
+
+def per_essay_requests(essay_count: int) -> int:
+    """Uploads as the previous code did, building a client per essay."""
+    responses = []
+    for index in range(essay_count):
+        responses += [({'status': '200'}, json.dumps({'id': f'file-{index}'})),
+                      ({'status': '200'}, json.dumps({'id': 'anyoneWithLink'}))]
+    http = HttpMockSequence(responses)
+    for index in range(essay_count):
+        service = build('drive', 'v3', http=http, static_discovery=True)
+        media = MediaIoBaseUpload(BytesIO(ESSAY_BYTES), mimetype='image/png')
+        drive_file = service.files().create(body={'name': f'{index}.png'},
+                                            media_body=media,
+                                            fields='id').execute()
+        service.permissions().create(fileId=drive_file['id'],
+                                     body=ANYONE_READER).execute()
+    return len(http.request_sequence)
+
+
+def uploader_run(paths: list[Path], workers: int) -> tuple[int, float]:
+    """Returns the requests issued and the seconds taken to upload paths."""
+    http = MockDrive()
+    start = perf_counter()
+    with DriveUploader.from_http(http) as uploader:
+        report = uploader.upload_files(paths, {'.png': 'image/png'}, workers)
+    elapsed = perf_counter() - start
+    if report.failures:
+        raise ValueError(f'Unexpected failures: {report.failures}')
+    return http.request_count, elapsed
+
+
+def main() -> None:
+    rows = []
+    with TemporaryDirectory() as temp_dir:
+        for essay_count in ESSAY_COUNTS:
+            paths = []
+            for index in range(essay_count):
+                path = Path(temp_dir) / f'{index}.png'
+                path.write_bytes(ESSAY_BYTES)
+                paths.append(path)
+            serial_requests, serial_time = uploader_run(paths, 1)
+            _, concurrent_time = uploader_run(paths, DriveConfig.WORKERS.value)
+            rows.append({
+                'essays': essay_count,
+                'per_essay_requests': per_essay_requests(essay_count) / essay_count,
+                'uploader_requests': serial_requests / essay_count,
+                'serial_s': serial_time,
+                f'{DriveConfig.WORKERS.value}_workers_s': concurrent_time,
+            })
+    results_df = pd.DataFrame(rows).set_index('essays')
+    print(f'Requests per essay and upload time with {LATENCY}s of latency')
+    print(results_df.round(3).to_string())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""Compares the metric evolution figures built per second with px.line and
+with MetricEvolutionFactory.
+
+Figures are built for every course of each exam in 4_final/forms. The
+factory time includes building its layouts. The written rate also includes
+serialising each figure to HTML, as stage e does.
+
+Run with `python -m mdv.benchmarks.figures` from src/.
+"""
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+import pandas as pd
+
+from mdv.config import DataDirectories
+from mdv.metrics import compute_metrics
+from mdv.plots import MetricEvolutionFactory, metric_evolution_figure, plotly_fig_to_html
+from mdv.storage import read_table
+
+EXAMS = ('fuvest', 'enem')
+
+
+def exam_courses(exam: str) -> list[pd.DataFrame]:
+    exam_df = read_table(DataDirectories.FOUR.value / 'forms' / exam)
+    return [df for _, df in compute_metrics(exam_df).groupby('id')]
+
+
+def px_figures(courses: list[pd.DataFrame]) -> list:
+    return [metric_evolution_figure(df) for df in courses]
+
+
+def factory_figures(courses: list[pd.DataFrame]) -> list:
+    factory = MetricEvolutionFactory(pd.concat(courses))
+    return [factory.figure_dict(df) for df in courses]
+
+
+def figures_per_second(build, courses: list[pd.DataFrame],
+                       output_dir: Path) -> tuple[float, float]:
+    """Returns the figures built and the figures built and written per second."""
+    start = perf_counter()
+    figs = build(courses)
+    build_time = perf_counter() - start
+    for index, fig in enumerate(figs):
+        plotly_fig_to_html(fig, output_dir / f'{index}.html')
+    write_time = perf_counter() - start
+    return len(courses) / build_time, len(courses) / write_time
+
+
+def main() -> None:
+    rows = []
+    with TemporaryDirectory() as temp_dir:
+        for exam in EXAMS:
+            courses = exam_courses(exam)
+            for name, build in [('px.line', px_figures), ('factory', factory_figures)]:
+                built, written = figures_per_second(build, courses, Path(temp_dir))
+                rows.append({
+                    'exam': exam,
+                    'builder': name,
+                    'figures': len(courses),
+                    'built_per_s': built,
+                    'written_per_s': written,
+                })
+    results_df = pd.DataFrame(rows).set_index(['exam', 'builder'])
+    print(results_df.round(1).to_string())
+
+
+if __name__ == '__main__':
+    main()
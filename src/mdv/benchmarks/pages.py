@@ -0,0 +1,119 @@
+"""Compares the course pages rendered with each figure mode.
+
+Writes the figures and tables of the first COURSES Fuvest courses with the
+'fragment' and 'page' modes of mdv.plots.plotly_fig_to_html, renders their
+notas pages and reports the page bytes, the <script> elements per page and
+the time Python's html.parser takes to parse a page, as a stand-in for the
+browser's parse time.
+
+Run with `python -m mdv.benchmarks.pages` from src/.
+"""
+from html.parser import HTMLParser
+from os import listdir
+from os.path import isdir, join, splitext
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+import pandas as pd
+
+from mdv.config import DataDirectories, REPOSITORY_ROOT
+from mdv.metrics import compute_metrics, latest_metrics
+from mdv.plots import (
+    FIGURE_MODES,
+    figure_page_assets,
+    partition_data_tables_by_course,
+    write_data_tables,
+    write_latest_metrics_table,
+    write_metric_evolution,
+)
+from mdv.storage import read_table
+
+COURSES = 20
+EXAM = 'fuvest'
+TABLE_COL_NAMES = ['chamada', 'nota_1', 'nota_2_1', 'nota_2_2', 'nota_final',
+                   'nota_redacao', 'classificacao_carreira', 'classificacao_curso']
+COL_FORMATS = [None, None, '.2f', '.2f', '.2f', '.1f', None, None]
+
+
+class ScriptCounter(HTMLParser):
+
+    def __init__(self):
+        super().__init__()
+        self.script_count = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'script':
+            self.script_count += 1
+
+
+def write_content(exam_df: pd.DataFrame, output_path: Path, figure_mode: str) -> float:
+    """Writes the content of every course of exam_df, returning the seconds taken."""
+    metrics_df = compute_metrics(exam_df)
+    for id, ano in exam_df[['id', 'ano']].drop_duplicates().itertuples(index=False):
+        (output_path / str(id) / EXAM / str(ano)).mkdir(parents=True, exist_ok=True)
+
+    start = perf_counter()
+    for id, df in metrics_df.groupby('id'):
+        write_metric_evolution(id, df, EXAM, output_path, figure_mode)
+    for id, df in latest_metrics(metrics_df).groupby('id'):
+        write_latest_metrics_table(id, df, EXAM, output_path, 'plotly', figure_mode)
+    for id, course_tables in partition_data_tables_by_course(exam_df, TABLE_COL_NAMES):
+        write_data_tables(id, course_tables, TABLE_COL_NAMES, TABLE_COL_NAMES,
+                          COL_FORMATS, EXAM, output_path, 'plotly', figure_mode)
+    return perf_counter() - start
+
+
+def render_page(template, exam_dir: str, page_assets: dict) -> str:
+    """Renders a notas page as stage f does."""
+    grade_dict = {}
+    for year in listdir(exam_dir):
+        year_dir = join(exam_dir, year)
+        if isdir(year_dir):
+            grade_dict[year] = {splitext(name)[0]: Path(year_dir, name).read_text('utf8')
+                                for name in listdir(year_dir)}
+    return template.render(
+        active_link='Notas',
+        root_path='../../../',
+        course_name='Curso',
+        latest_metrics_plotly_div=Path(exam_dir, 'latest_metrics.html').read_text('utf8'),
+        metric_evolution_plotly_div=Path(exam_dir, 'metric_evolution.html').read_text('utf8'),
+        grade_dict=grade_dict,
+        **page_assets)
+
+
+def main() -> None:
+    exam_df = read_table(DataDirectories.FOUR.value / 'forms' / EXAM)
+    course_ids = sorted(exam_df.id.dropna().unique())[:COURSES]
+    exam_df = exam_df.loc[exam_df.id.isin(course_ids)]
+    jinja_env = Environment(loader=FileSystemLoader(REPOSITORY_ROOT / 'templates'),
+                            autoescape=select_autoescape())
+    template = jinja_env.get_template('notas.html.jinja')
+
+    rows = []
+    with TemporaryDirectory() as temp_dir:
+        for figure_mode in FIGURE_MODES:
+            output_path = Path(temp_dir) / figure_mode
+            write_time = write_content(exam_df, output_path, figure_mode)
+            page_assets = figure_page_assets() if figure_mode == 'page' else {}
+            for id in course_ids:
+                page = render_page(template, join(output_path, str(id), EXAM), page_assets)
+                parser = ScriptCounter()
+                start = perf_counter()
+                parser.feed(page)
+                parser.close()
+                rows.append({
+                    'mode': figure_mode,
+                    'write_s': write_time,
+                    'page_kb': len(page.encode('utf8')) / 1024,
+                    'scripts': parser.script_count,
+                    'parse_ms': 1000 * (perf_counter() - start),
+                })
+    results_df = pd.DataFrame(rows).groupby('mode', sort=False).mean()
+    print(f'Mean over the notas pages of {len(course_ids)} {EXAM} courses')
+    print(results_df.round(2).to_string())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,267 @@
+"""Measures how stage e scales with the size of the form data.
+
+Generates synthetic Fuvest and Enem forms with the schemas of 4_final/forms
+at SCALES times the rows, courses and years of the real datasets, and
+writes the content of every course as e_create_plots_and_tables.py does,
+with the table backends and figure mode of PlotsConfig. Each artefact
+family reports its wall time, the peak memory Python allocated while
+writing it, as traced by tracemalloc, and the bytes it wrote:
+
+- metrics: mdv.metrics.compute_metrics and its table in 4_final/metrics;
+- metric_evolution: the metric evolution figures;
+- latest_metrics: the tables of the metrics of the latest year;
+- data_tables: the tables of the forms of every year and quota.
+
+Every family is run twice, once timed and once traced, since tracing
+slows it down. Courses are written in this process rather than by the
+pool of stage e, so that their allocations are traced, which makes wall
+times those of a single worker.
+
+Run with `python -m mdv.benchmarks.stage_e` from src/, optionally with
+e.g. `--scales 1 10 --exams fuvest` as the 100x datasets take hours.
+"""
+from argparse import ArgumentParser
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from typing import Callable, NamedTuple
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from mdv.config import PlotsConfig
+from mdv.metrics import compute_metrics, latest_metrics, select_metrics
+from mdv.plots import (
+    METRIC_COLUMNS,
+    MetricEvolutionFactory,
+    partition_data_tables_by_course,
+    write_data_tables,
+    write_latest_metrics_table,
+    write_metric_evolution,
+)
+from mdv.storage import write_table
+
+SCALES = (1, 10, 100)
+SEED = 0
+LATEST_YEAR = 2023
+FAMILIES = ('metrics', 'metric_evolution', 'latest_metrics', 'data_tables')
+QUOTAS = ['Ampla Concorrência (AC)',
+          'Escola Pública (EP)',
+          'Pretos, Pardos e Indígenas (PPI)']
+QUOTA_WEIGHTS = [0.6, 0.25, 0.15]
+CALLS = [None, 'Primeira', 'Segunda', 'Terceira', 'Após a terceira',
+         'Lista de espera - Primeira']
+CALL_WEIGHTS = [0.6, 0.3, 0.04, 0.02, 0.02, 0.02]
+ESSAY_URL = 'https://drive.google.com/open?id='
+TABLE_SETTINGS = {
+    'fuvest': (['chamada', 'nota_1', 'nota_2_1', 'nota_2_2', 'nota_final',
+                'nota_redacao', 'classificacao_carreira', 'classificacao_curso'],
+               [None, None, '.2f', '.2f', '.2f', '.1f', None, None]),
+    'enem': (['chamada', 'nota_linguagens', 'nota_humanas', 'nota_natureza',
+              'nota_matematica', 'nota_redacao', 'nota_final'],
+             [None, '.2f', '.2f', '.2f', '.2f', '.3d', '.2f']),
+}
+
+
+class FormsShape(NamedTuple):
+    rows            : int
+    courses         : int
+    years           : int
+    course_years    : int
+
+
+# Shapes of the real datasets at 1x, where course_years is about the mean
+# number of years with forms of a course
+SHAPES = {
+    'fuvest': FormsShape(rows=3280, courses=150, years=10, course_years=3),
+    'enem': FormsShape(rows=487, courses=82, years=7, course_years=2),
+}
+
+
+class FamilyResult(NamedTuple):
+    seconds         : float
+    peak_bytes      : int
+    written_bytes   : int
+
+
+def scaled_shape(exam: str, scale: int) -> FormsShape:
+    return FormsShape(*(scale * value for value in SHAPES[exam]))
+
+
+def masked(values: np.ndarray, rng: np.random.Generator, na_fraction: float,
+           dtype: str, mask: np.ndarray | None = None) -> pd.Series:
+    """Returns values as a dtype series, missing in a random na_fraction of
+    the rows, or in the rows of mask."""
+    if mask is None:
+        mask = rng.random(len(values)) < na_fraction
+    return pd.Series(values, dtype=dtype).mask(mask)
+
+
+def synthetic_courses(shape: FormsShape, rng: np.random.Generator) -> pd.DataFrame:
+    """Draws the course, year, quota and call of every form.
+
+    Each course has forms in course_years consecutive years out of the
+    last years ones.
+    """
+    first_years = LATEST_YEAR - shape.years + 1 + rng.integers(
+        0, shape.years - shape.course_years + 1, shape.courses)
+    ids = rng.integers(0, shape.courses, shape.rows)
+    years = first_years[ids] + rng.integers(0, shape.course_years, shape.rows)
+    return pd.DataFrame({
+        'id': pd.Series(ids, dtype='Int64'),
+        'unidade': pd.Series(ids % 40, dtype='string').radd('Unidade '),
+        'curso': pd.Series(ids, dtype='string').radd('Curso '),
+        'ano': pd.Series(years, dtype='Int64'),
+        'modalidade': pd.Series(rng.choice(QUOTAS, shape.rows, p=QUOTA_WEIGHTS),
+                                dtype='string'),
+        'chamada': pd.Series(rng.choice(CALLS, shape.rows, p=CALL_WEIGHTS),
+                             dtype='string'),
+    })
+
+
+def synthetic_essays(rows: int, rng: np.random.Generator, na_fraction: float) -> pd.Series:
+    links = [f'{ESSAY_URL}{token:033x}' for token in rng.integers(0, 2**62, rows)]
+    return masked(np.array(links, dtype=object), rng, na_fraction, 'string')
+
+
+def synthetic_fuvest(scale: int, seed: int = SEED) -> pd.DataFrame:
+    """Generates Fuvest forms with the columns and dtypes of 4_final/forms/fuvest."""
+    rng = np.random.default_rng(seed)
+    shape = scaled_shape('fuvest', scale)
+    forms = synthetic_courses(shape, rng)
+    forms['ano'] = forms['ano'].astype('string')
+    not_called = forms['chamada'].isna().to_numpy()
+    forms['nota_1'] = pd.Series(rng.integers(29, 91, shape.rows), dtype='Int64')
+    forms['nota_2_1'] = pd.Series(rng.uniform(20, 100, shape.rows).round(2), dtype='Float64')
+    forms['nota_2_2'] = pd.Series(rng.uniform(0, 100, shape.rows).round(2), dtype='Float64')
+    forms['nota_final'] = pd.Series(rng.uniform(300, 900, shape.rows).round(6), dtype='Float64')
+    forms['nota_redacao'] = masked(rng.integers(14, 101, shape.rows) / 2, rng, 0.01, 'Float64')
+    forms['classificacao_carreira'] = masked(rng.integers(0, 4000, shape.rows),
+                                             rng, 0.07, 'Int64')
+    forms['classificacao_curso'] = masked(rng.integers(0, 4000, shape.rows),
+                                          rng, 0, 'Int64', not_called)
+    forms['redacao'] = synthetic_essays(shape.rows, rng, 0.83)
+    return forms
+
+
+def synthetic_enem(scale: int, seed: int = SEED) -> pd.DataFrame:
+    """Generates Enem forms with the columns and dtypes of 4_final/forms/enem."""
+    rng = np.random.default_rng(seed)
+    shape = scaled_shape('enem', scale)
+    forms = synthetic_courses(shape, rng)
+    no_scores = rng.random(shape.rows) < 0.09
+    for column in ['nota_linguagens', 'nota_humanas', 'nota_natureza', 'nota_matematica']:
+        forms[column] = masked(rng.uniform(400, 990, shape.rows).round(1),
+                               rng, 0, 'Float64', no_scores)
+    forms['nota_redacao'] = masked(20 * rng.integers(30, 51, shape.rows),
+                                   rng, 0, 'Int64', no_scores)
+    forms['nota_final'] = pd.Series(rng.uniform(600, 850, shape.rows).round(3), dtype='Float64')
+    no_competencies = rng.random(shape.rows) < 0.68
+    for competency in range(1, 6):
+        forms[f'nota_redacao_c{competency}'] = masked(20 * rng.integers(0, 11, shape.rows),
+                                                      rng, 0, 'Int64', no_competencies)
+    forms['redacao'] = synthetic_essays(shape.rows, rng, 0.95)
+    return forms
+
+
+SYNTHETIC_FORMS = {
+    'fuvest': synthetic_fuvest,
+    'enem': synthetic_enem,
+}
+
+
+def directory_bytes(path: Path) -> int:
+    return sum(file.stat().st_size for file in path.rglob('*') if file.is_file())
+
+
+def measure(write: Callable[[], None], output_path: Path) -> FamilyResult:
+    """Times write, then runs it again under tracemalloc for its peak memory.
+
+    The written bytes are the growth of output_path in the timed run.
+    """
+    initial_bytes = directory_bytes(output_path)
+    start = perf_counter()
+    write()
+    seconds = perf_counter() - start
+    written_bytes = directory_bytes(output_path) - initial_bytes
+
+    tracemalloc.start()
+    try:
+        write()
+        peak_bytes = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return FamilyResult(seconds, peak_bytes, written_bytes)
+
+
+def benchmark_exam(exam_df: pd.DataFrame, exam: str, output_dir: Path) -> dict[str, FamilyResult]:
+    """Writes the content of every course of exam_df under output_dir,
+    returning the result of each artefact family."""
+    content_path = output_dir / 'content'
+    metrics_path = output_dir / 'metrics'
+    metrics_path.mkdir(parents=True)
+    for id, ano in exam_df[['id', 'ano']].drop_duplicates().itertuples(index=False):
+        (content_path / str(id) / exam / str(ano)).mkdir(parents=True, exist_ok=True)
+
+    table_backends = PlotsConfig.TABLE_BACKENDS.value
+    figure_mode = PlotsConfig.FIGURE_MODE.value
+    cols, cells_format = TABLE_SETTINGS[exam]
+    results = {}
+
+    def write_metrics():
+        write_table(compute_metrics(exam_df), metrics_path / exam)
+
+    def write_metric_evolutions():
+        metrics_df = select_metrics(compute_metrics(exam_df), METRIC_COLUMNS)
+        factory = MetricEvolutionFactory(metrics_df)
+        for id, df in metrics_df.groupby('id'):
+            write_metric_evolution(id, df, exam, content_path, figure_mode, factory)
+
+    def write_latest_metrics_tables():
+        for id, df in latest_metrics(compute_metrics(exam_df)).groupby('id'):
+            write_latest_metrics_table(id, df, exam, content_path,
+                                       table_backends['latest_metrics'], figure_mode)
+
+    def write_all_data_tables():
+        for id, course_tables in partition_data_tables_by_course(exam_df, cols):
+            write_data_tables(id, course_tables, cols, cols, cells_format,
+                              exam, content_path, table_backends['data'], figure_mode)
+
+    for family, write in zip(FAMILIES, [write_metrics, write_metric_evolutions,
+                                        write_latest_metrics_tables, write_all_data_tables]):
+        results[family] = measure(write, metrics_path if family == 'metrics' else content_path)
+    return results
+
+
+def main() -> None:
+    parser = ArgumentParser(description='Measures how stage e scales with the form data.')
+    parser.add_argument('--scales', type=int, nargs='+', default=list(SCALES))
+    parser.add_argument('--exams', nargs='+', choices=list(SYNTHETIC_FORMS),
+                        default=list(SYNTHETIC_FORMS))
+    args = parser.parse_args()
+
+    rows = []
+    for scale in args.scales:
+        for exam in args.exams:
+            exam_df = SYNTHETIC_FORMS[exam](scale)
+            with TemporaryDirectory() as temp_dir:
+                results = benchmark_exam(exam_df, exam, Path(temp_dir))
+            for family, result in results.items():
+                rows.append({
+                    'scale': scale,
+                    'exam': exam,
+                    'family': family,
+                    'rows': len(exam_df),
+                    'courses': exam_df['id'].nunique(),
+                    'wall_s': result.seconds,
+                    'peak_mb': result.peak_bytes / 2**20,
+                    'written_mb': result.written_bytes / 2**20,
+                })
+            print(f'{scale}x {exam} done', flush=True)
+    results_df = pd.DataFrame(rows).set_index(['scale', 'exam', 'family'])
+    print(results_df.round(3).to_string())
+
+
+if __name__ == '__main__':
+    main()
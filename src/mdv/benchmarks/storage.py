@@ -0,0 +1,61 @@
+"""Compares read time, write time and file size of the storage formats.
+
+Run with `python -m mdv.benchmarks.storage` from src/.
+"""
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+import pandas as pd
+
+from mdv.config import DataDirectories
+from mdv.storage import SUFFIXES, read_table, write_table
+
+REPEATS = 5
+DATASETS = {
+    'forms/enem': DataDirectories.FOUR.value / 'forms' / 'enem',
+    'forms/fuvest': DataDirectories.FOUR.value / 'forms' / 'fuvest',
+    'redacoes/enem': DataDirectories.FOUR.value / 'redacoes' / 'enem',
+    'redacoes/fuvest': DataDirectories.FOUR.value / 'redacoes' / 'fuvest',
+    'vagas': DataDirectories.FOUR.value / 'vagas',
+}
+
+
+def best_time(func, repeats: int = REPEATS) -> float:
+    times = []
+    for _ in range(repeats):
+        start = perf_counter()
+        func()
+        times.append(perf_counter() - start)
+    return min(times)
+
+
+def benchmark_dataset(df: pd.DataFrame, output_dir: Path) -> list[dict]:
+    results = []
+    for storage_format in SUFFIXES:
+        path = output_dir / storage_format
+        write_time = best_time(lambda: write_table(df, path, storage_format))
+        written_path = write_table(df, path, storage_format)
+        read_time = best_time(lambda: read_table(written_path))
+        results.append({
+            'format': storage_format,
+            'write_ms': 1000 * write_time,
+            'read_ms': 1000 * read_time,
+            'size_kb': written_path.stat().st_size / 1024,
+        })
+    return results
+
+
+def main() -> None:
+    rows = []
+    with TemporaryDirectory() as temp_dir:
+        for name, path in DATASETS.items():
+            df = read_table(path)
+            for result in benchmark_dataset(df, Path(temp_dir)):
+                rows.append({'dataset': name, 'rows': len(df), **result})
+    results_df = pd.DataFrame(rows).set_index(['dataset', 'format'])
+    print(results_df.round(2).to_string())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""Compares build time and size of the tables written by each table backend.
+
+Writes the latest metrics tables and data tables of every course, as stage e
+does, with the Plotly and the static HTML backends. Sizes are of the written
+files, which the notas pages embed as they are.
+
+Run with `python -m mdv.benchmarks.tables` from src/.
+"""
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+import pandas as pd
+
+from mdv.config import DataDirectories
+from mdv.metrics import compute_metrics, latest_metrics
+from mdv.plots import (
+    LATEST_METRICS_COLUMNS,
+    LATEST_METRICS_FORMATS,
+    LATEST_METRICS_HEADER,
+    TABLE_BACKENDS,
+    partition_data_tables,
+    write_table,
+)
+from mdv.storage import read_table
+
+INPUT_PATH = DataDirectories.FOUR.value / 'forms'
+DATA_TABLE_SETTINGS = {
+    'fuvest': (['chamada', 'nota_1', 'nota_2_1', 'nota_2_2', 'nota_final',
+                'nota_redacao', 'classificacao_carreira', 'classificacao_curso'],
+               [None, None, '.2f', '.2f', '.2f', '.1f', None, None]),
+    'enem': (['chamada', 'nota_linguagens', 'nota_humanas', 'nota_natureza',
+              'nota_matematica', 'nota_redacao', 'nota_final'],
+             [None, '.2f', '.2f', '.2f', '.2f', '.3d', '.2f']),
+}
+
+
+def exam_tables(exam: str) -> dict[str, list[tuple]]:
+    """Returns the (df, cols, header, cells_format) of every table of exam,
+    by table type."""
+    exam_df = read_table(INPUT_PATH / exam)
+    cols, cells_format = DATA_TABLE_SETTINGS[exam]
+    return {
+        'latest_metrics': [(df, LATEST_METRICS_COLUMNS,
+                            LATEST_METRICS_HEADER, LATEST_METRICS_FORMATS)
+                           for _, df in latest_metrics(compute_metrics(exam_df)).groupby('id')],
+        'data': [(table_df, cols, cols, cells_format)
+                 for _, table_df in partition_data_tables(exam_df, cols)],
+    }
+
+
+def backend_run(tables: list[tuple], backend: str, output_dir: Path) -> tuple[float, int]:
+    """Returns the seconds taken to write tables and their total bytes."""
+    paths = [output_dir / f'{index}.html' for index in range(len(tables))]
+    start = perf_counter()
+    for path, table in zip(paths, tables):
+        write_table(*table, path, backend)
+    elapsed = perf_counter() - start
+    return elapsed, sum(path.stat().st_size for path in paths)
+
+
+def main() -> None:
+    rows = []
+    with TemporaryDirectory() as temp_dir:
+        for exam in DATA_TABLE_SETTINGS:
+            for table_type, tables in exam_tables(exam).items():
+                for backend in TABLE_BACKENDS:
+                    elapsed, size = backend_run(tables, backend, Path(temp_dir))
+                    rows.append({
+                        'exam': exam,
+                        'table': table_type,
+                        'backend': backend,
+                        'tables': len(tables),
+                        'ms_per_table': 1000 * elapsed / len(tables),
+                        'kb_per_table': size / 1024 / len(tables),
+                        'total_mb': size / 2**20,
+                    })
+    results_df = pd.DataFrame(rows).set_index(['exam', 'table', 'backend'])
+    print(results_df.round(2).to_string())
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,9 @@
+import os
 from pathlib import Path
 from enum import Enum
+from typing import Any, NamedTuple
+
+import pandas as pd
 
 REPOSITORY_ROOT = (Path(__file__).parent / '..' / '..').resolve()
 
@@ -11,14 +15,103 @@ class DataDirectories(Enum):
     FOUR    : Path = ROOT / '4_final'
     FIVE    : Path = ROOT / '5_content'
 
+class StorageConfig(Enum):
+    # One of 'parquet', 'feather' or 'csv'
+    FORMAT          : str = 'parquet'
+    # Format of the tables written to 2_intermediate and 3_processed, which
+    # are reviewed and edited by hand before stage d
+    REVIEW_FORMAT   : str = 'csv'
+
 class Exams(Enum):
     ENEM = 'Enem'
     FUVEST = 'Fuvest'
 
+class Field(NamedTuple):
+    """Maps a source column to a typed target column.
+
+    When source is None or missing from the frame, the target column is
+    filled with default.
+    """
+    source  : str | None
+    target  : str
+    dtype   : str = 'object'
+    default : Any = pd.NA
+
+class FormSchemas(Enum):
+    ENEM    : tuple[Field, ...] = (
+        Field('Qual o seu ano de ingresso?',            'ano',             'Int64'),
+        Field('Modalidade',                             'modalidade',      'string'),
+        Field('Chamada',                                'chamada',         'string'),
+        Field('Linguagens',                             'nota_linguagens', 'Float64'),
+        Field('Ciências Humanas',                       'nota_humanas',    'Float64'),
+        Field('Ciências da Natureza',                   'nota_natureza',   'Float64'),
+        Field('Matemática',                             'nota_matematica', 'Float64'),
+        Field('Redação',                                'nota_redacao',    'Int64'),
+        Field('Nota final.1',                           'nota_final',      'Float64'),
+        Field('Nota na Competência 1',                  'nota_redacao_c1', 'Int64'),
+        Field('Nota na Competência 2',                  'nota_redacao_c2', 'Int64'),
+        Field('Nota na Competência 3',                  'nota_redacao_c3', 'Int64'),
+        Field('Nota na Competência 4',                  'nota_redacao_c4', 'Int64'),
+        Field('Nota na Competência 5',                  'nota_redacao_c5', 'Int64'),
+        Field('Envie aqui o espelho da sua redação.1',  'redacao',         'string'),
+    )
+    FUVEST  : tuple[Field, ...] = (
+        Field('Qual o seu ano de ingresso?',            'ano',                    'Int64'),
+        Field('Modalidade',                             'modalidade',             'string'),
+        Field('Chamada',                                'chamada',                'string'),
+        Field('Nota na 1° fase',                        'nota_1',                 'Int64'),
+        Field('Nota na 2° fase, 1° dia',                'nota_2_1',               'Float64'),
+        Field('Nota na 2° fase, 2° dia',                'nota_2_2',               'Float64'),
+        Field('Nota final',                             'nota_final',             'Float64'),
+        Field('Nota da redação',                        'nota_redacao',           'Float64'),
+        Field('Classificação na carreira',              'classificacao_carreira', 'Int64'),
+        Field('Classificação no curso de ingresso',     'classificacao_curso',    'Int64'),
+        Field('Envie aqui o espelho da sua redação',    'redacao',                'string'),
+    )
+
+class FormsConfig(Enum):
+    WORKERS     : int = os.cpu_count() or 1
+    # Rows read at a time from each form, None reads whole forms at once
+    CHUNKSIZE   : int | None = None
+
+class EssaySchemas(Enum):
+    ENEM    : tuple[Field, ...] = (
+        Field('ano',                'ano',  'Int64'),
+        Field('nota_redacao',       'nota', 'Int64'),
+        Field('nota_redacao_c1',    'c1',   'Int64'),
+        Field('nota_redacao_c2',    'c2',   'Int64'),
+        Field('nota_redacao_c3',    'c3',   'Int64'),
+        Field('nota_redacao_c4',    'c4',   'Int64'),
+        Field('nota_redacao_c5',    'c5',   'Int64'),
+    )
+    FUVEST  : tuple[Field, ...] = (
+        Field('ano',                'ano',  'Int64'),
+        Field('nota_redacao',       'nota', 'Float64'),
+    )
+
 class EssaysConfig(Enum):
     YEAR            : str   = '2022'
     REVISION_DIR    : str   = 'revisao'
     NO_REVISION_DIR : str   = 'pronto'
+    DUPLICATE_DIR   : str   = 'duplicadas'
+    WORKERS         : int   = os.cpu_count() or 1
+    # One of 'png', 'grey', 'bilevel', 'palette', 'webp' or 'jpeg'
+    ENCODING        : str   = 'png'
+    # Threshold for bilevel, number of colours for palette and quality
+    # (0-100) for webp and jpeg
+    QUALITY         : dict[str, int] = {
+        'bilevel': 160,
+        'palette': 16,
+        'webp'   : 80,
+        'jpeg'   : 85,
+    }
+    # Largest (width, height) of the cropped essays, A4 at 300 dpi; larger
+    # scans are reduced while decoding. None keeps the original resolution
+    MAX_SIZE        : tuple[int, int] | None = (2480, 3508)
+    # Memory in MiB each worker may use for a single scan. Scans are reduced
+    # while decoding to fit it, and scans that cannot be decoded within it
+    # are sent to revision. None for no limit
+    MEMORY_BUDGET   : int | None = 256
     ASPECT_RATIO    : dict[str, float] = {
         'enem'  : 0.74,
         'fuvest': 0.705,
@@ -31,3 +124,53 @@ class EssaysConfig(Enum):
         'enem'  : 0.1977,
         'fuvest': 0.1465,
     }
+    # Header detection on greyscale thumbnails of width x height pixels,
+    # batch_size scans at a time. The header end is searched for within
+    # search_window (normalized height) of NORMALIZED_CROP_HEIGHT, below the
+    # row with most pixels darker than the paper by darkness, and only trusted
+    # when that row has at least min_coverage of them. Header ends further
+    # than max_offset from NORMALIZED_CROP_HEIGHT are ignored in favour of
+    # the aspect ratio check
+    HEADER_DETECTION: dict[str, float] = {
+        'width'        : 128,
+        'height'       : 512,
+        'batch_size'   : 64,
+        'search_window': 0.05,
+        'darkness'     : 0.15,
+        'min_coverage' : 0.8,
+        'max_offset'   : 0.03,
+    }
+    # Near-duplicate essays have DCT perceptual hashes, computed on
+    # image_size x image_size greyscale images batch_size at a time, that
+    # differ by at most max_distance of their 64 bits
+    DEDUP           : dict[str, int] = {
+        'image_size'  : 32,
+        'batch_size'  : 256,
+        'max_distance': 4,
+    }
+
+class PlotsConfig(Enum):
+    # Processes writing the figures and tables of stage e, by course
+    WORKERS : int = os.cpu_count() or 1
+    # Backend of each table type, 'plotly' for go.Table or 'html' for
+    # static HTML tables formatted when written
+    TABLE_BACKENDS : dict = {'latest_metrics': 'plotly', 'data': 'plotly'}
+    # 'fragment' for figures loading Plotly by themselves, or 'page' for
+    # figure specs plotted by a single script of each rendered page
+    FIGURE_MODE : str = 'fragment'
+
+class DriveConfig(Enum):
+    SERVICE_ACCOUNT_FILE: str = 'service.json'
+    SCOPES          : tuple[str, ...] = ('https://www.googleapis.com/auth/drive',)
+    VIEW_BASE_URL   : str = 'https://drive.google.com/file/d/{}/view'
+    # Records the essays already uploaded, see mdv.drive.UploadLedger
+    LEDGER_FILENAME : str = 'uploads.jsonl'
+    # Calls grouped in each batch request, Drive accepts up to 100
+    BATCH_SIZE      : int = 100
+    # Concurrent uploads
+    WORKERS         : int = 8
+    # Retries, with exponential backoff, of requests failing with 429 or 5xx
+    RETRIES         : int = 5
+    # Files larger than RESUMABLE_SIZE bytes are uploaded in CHUNKSIZE chunks
+    RESUMABLE_SIZE  : int = 5 * 2**20
+    CHUNKSIZE       : int = 8 * 2**20
@@ -0,0 +1,205 @@
+from concurrent.futures import Executor
+from pathlib import Path
+from typing import Iterable, Sequence
+import json
+
+from PIL import Image
+import numpy as np
+import pandas as pd
+
+from mdv.config import EssaysConfig
+
+LEDGER_SUFFIX = '.json'
+# Number of set bits of every byte value
+BYTE_POPCOUNTS = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None],
+                               axis=1).sum(axis=1)
+
+
+def load_hash_image(image_path: Path) -> np.ndarray:
+    """Returns the image as a square greyscale array of EssaysConfig.DEDUP['image_size'] pixels."""
+    image_size = int(EssaysConfig.DEDUP.value['image_size'])
+    size = (image_size, image_size)
+    with Image.open(image_path) as image:
+        image.draft('L', size)
+        small_image = image.convert('L').resize(size, Image.Resampling.BOX)
+    return np.asarray(small_image, dtype=np.float32)
+
+
+def dct_matrix(size: int) -> np.ndarray:
+    """Returns the orthonormal DCT-II matrix of the given size."""
+    frequencies = np.arange(size)[:, None]
+    positions = np.arange(size)[None, :]
+    matrix = np.cos(np.pi * (2*positions + 1) * frequencies / (2*size))
+    matrix[0] /= np.sqrt(2)
+    return (matrix * np.sqrt(2/size)).astype(np.float32)
+
+
+def perceptual_hashes(images: np.ndarray) -> np.ndarray:
+    """Computes the 64 bit DCT perceptual hash of a batch of images.
+
+    images has shape (images, size, size). Each bit of a hash tells whether
+    one of the 8 x 8 lowest frequencies of the image is above their median,
+    so resizing, recompression and small edits leave most bits unchanged.
+    """
+    dct = dct_matrix(images.shape[-1])
+    coefficients = dct @ images @ dct.T
+    low_frequencies = coefficients[:, :8, :8].reshape(len(images), 64)
+    medians = np.median(low_frequencies, axis=1, keepdims=True)
+    bits = np.packbits(low_frequencies > medians, axis=1)
+    return bits.view('>u8')[:, 0].astype(np.uint64)
+
+
+def hamming_distances(hashes: np.ndarray, other_hashes: np.ndarray) -> np.ndarray:
+    """Returns the number of differing bits of each pair of hashes."""
+    differences = np.bitwise_xor(hashes, other_hashes)
+    return BYTE_POPCOUNTS[differences.view(np.uint8).reshape(-1, 8)].sum(axis=1)
+
+
+class HammingIndex:
+    """Finds the pairs of hashes within max_distance bits of each other.
+
+    Hashes are split into max_distance + 1 bands of bits. Two hashes within
+    max_distance bits agree on at least one band, so only hashes sharing a
+    band value are compared instead of every pair.
+    """
+
+    def __init__(self, hashes: np.ndarray, max_distance: int):
+        self.hashes = np.asarray(hashes, dtype=np.uint64)
+        self.max_distance = max_distance
+        band_count = max_distance + 1
+        self.band_edges = np.linspace(0, 64, band_count + 1).astype(int)
+
+    def _band_values(self, start: int, end: int) -> np.ndarray:
+        mask = np.uint64((1 << (end - start)) - 1)
+        return (self.hashes >> np.uint64(start)) & mask
+
+    def pairs(self) -> np.ndarray:
+        """Returns the (i, j) index pairs, i < j, of near-duplicate hashes."""
+        candidates = []
+        for start, end in zip(self.band_edges[:-1], self.band_edges[1:]):
+            band_values = self._band_values(start, end)
+            order = np.argsort(band_values, kind='stable')
+            sorted_values = band_values[order]
+            group_starts = np.flatnonzero(np.r_[True, sorted_values[1:] != sorted_values[:-1]])
+            group_ends = np.r_[group_starts[1:], len(order)]
+            for group_start, group_end in zip(group_starts, group_ends):
+                if group_end - group_start < 2:
+                    continue
+                group = order[group_start:group_end]
+                first, second = np.triu_indices(len(group), k=1)
+                candidates.append(np.column_stack([group[first], group[second]]))
+        if not candidates:
+            return np.empty((0, 2), dtype=int)
+
+        candidate_pairs = np.unique(np.sort(np.concatenate(candidates), axis=1), axis=0)
+        distances = hamming_distances(self.hashes[candidate_pairs[:, 0]],
+                                      self.hashes[candidate_pairs[:, 1]])
+        return candidate_pairs[distances <= self.max_distance]
+
+
+def cluster_pairs(count: int, pairs: np.ndarray, reference_count: int = 0) -> np.ndarray:
+    """Labels each of count items with the index of the representative of
+    its cluster.
+
+    Items are taken in order, and each joins the cluster of the first
+    earlier representative it is paired with, or else represents a new
+    cluster. Items are only compared with representatives, so clusters do
+    not chain through items paired with each other but not with their
+    representative. The first reference_count items always represent their
+    own cluster.
+    """
+    labels = np.arange(count)
+    for first, second in pairs[np.lexsort((pairs[:, 0], pairs[:, 1]))]:
+        if second < reference_count or labels[second] != second:
+            continue
+        if first < reference_count or labels[first] == first:
+            labels[second] = first
+    return labels
+
+
+def hash_images(image_paths: Sequence[Path],
+                executor: Executor | None = None) -> np.ndarray:
+    """Hashes the images EssaysConfig.DEDUP['batch_size'] at a time,
+    loading them on executor when given."""
+    batch_size = int(EssaysConfig.DEDUP.value['batch_size'])
+    map_images = map if executor is None else executor.map
+    hashes = [np.empty(0, dtype=np.uint64)]
+    for start in range(0, len(image_paths), batch_size):
+        batch_paths = image_paths[start:start+batch_size]
+        images = np.stack(list(map_images(load_hash_image, batch_paths)))
+        hashes.append(perceptual_hashes(images))
+    return np.concatenate(hashes)
+
+
+def ledger_path(duplicate_dir: Path) -> Path:
+    return Path(duplicate_dir).with_suffix(LEDGER_SUFFIX)
+
+
+def read_reviewed_pairs(duplicate_dir: Path) -> set[tuple[str, str]]:
+    """Returns the (duplicate, kept) file names of the pairs moved to
+    duplicate_dir for review by move_duplicates."""
+    path = ledger_path(duplicate_dir)
+    if not path.exists():
+        return set()
+    with open(path, 'r', encoding='utf8') as f:
+        return {tuple(pair) for pair in json.load(f)}
+
+
+def record_reviewed_pairs(duplicate_dir: Path, pairs: Iterable[tuple[str, str]]) -> None:
+    reviewed_pairs = read_reviewed_pairs(duplicate_dir) | set(pairs)
+    with open(ledger_path(duplicate_dir), 'w', encoding='utf8') as f:
+        json.dump(sorted(reviewed_pairs), f, indent=2)
+
+
+def find_duplicates(image_paths: Sequence[Path],
+                    reference_paths: Sequence[Path] = (),
+                    executor: Executor | None = None,
+                    reviewed_pairs: Iterable[tuple[str, str]] = ()) -> pd.DataFrame:
+    """Clusters near-duplicate images and picks the copy to keep of each.
+
+    reference_paths are images kept by earlier runs, e.g. previous years, so
+    any image matching one of them is a duplicate. Otherwise the first image
+    of each cluster, in the order of image_paths, is kept. Images are near
+    duplicates when their perceptual hashes differ by at most
+    EssaysConfig.DEDUP['max_distance'] bits from those of the kept image,
+    see cluster_pairs. reviewed_pairs are (duplicate, kept) file names
+    already reviewed, see read_reviewed_pairs; their images are not paired
+    again, so essays moved back from review stay where they are.
+
+    Returns the path, hash, cluster and is_duplicate flag of each image in
+    image_paths, the cluster being the path of the kept image.
+    """
+    all_paths = [Path(path) for path in [*reference_paths, *image_paths]]
+    hashes = hash_images(all_paths, executor)
+    max_distance = int(EssaysConfig.DEDUP.value['max_distance'])
+    pairs = HammingIndex(hashes, max_distance).pairs()
+    reviewed_pairs = {frozenset(pair) for pair in reviewed_pairs}
+    if reviewed_pairs:
+        names = [path.name for path in all_paths]
+        is_reviewed = [frozenset([names[first], names[second]]) in reviewed_pairs
+                       for first, second in pairs]
+        pairs = pairs[~np.array(is_reviewed, dtype=bool)]
+    clusters = cluster_pairs(len(all_paths), pairs, len(reference_paths))
+
+    indices = np.arange(len(reference_paths), len(all_paths))
+    return pd.DataFrame({
+        'path': [all_paths[index] for index in indices],
+        'hash': [f'{hashes[index]:016x}' for index in indices],
+        'cluster': [all_paths[clusters[index]] for index in indices],
+        'is_duplicate': clusters[indices] != indices,
+    })
+
+
+def move_duplicates(duplicates_df: pd.DataFrame, duplicate_dir: Path) -> list[Path]:
+    """Moves the duplicates found by find_duplicates to duplicate_dir for
+    review, recording each with the image kept in its place in the ledger
+    next to duplicate_dir (see read_reviewed_pairs)."""
+    duplicate_dir.mkdir(parents=True, exist_ok=True)
+    moved_paths = []
+    moved_pairs = []
+    duplicates = duplicates_df.loc[duplicates_df.is_duplicate]
+    for path, cluster in duplicates[['path', 'cluster']].itertuples(index=False):
+        moved_paths.append(path.replace(duplicate_dir / path.name))
+        moved_pairs.append((path.name, cluster.name))
+    record_reviewed_pairs(duplicate_dir, moved_pairs)
+    return moved_paths
@@ -0,0 +1,322 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import BinaryIO, Callable, Iterable, NamedTuple
+import json
+import os
+import random
+import threading
+import time
+
+from google.oauth2 import service_account
+from google_auth_httplib2 import AuthorizedHttp
+from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
+from googleapiclient.http import MediaIoBaseUpload
+import httplib2
+
+from mdv.config import DriveConfig
+from mdv.manifest import file_hash
+
+ANYONE_READER = {'type': 'anyone', 'role': 'reader'}
+TOO_MANY_REQUESTS = 429
+# Errors of a request to the Drive API, either from the API or the connection
+REQUEST_ERRORS = (HttpError, httplib2.HttpLib2Error, OSError)
+
+
+class UploadFailure(NamedTuple):
+    path    : Path
+    error   : Exception
+
+
+class UploadReport(NamedTuple):
+    drive_ids   : dict[Path, str]
+    failures    : list[UploadFailure]
+
+
+def is_retryable(error: Exception) -> bool:
+    """Tells whether a request failed with 429, 5xx or a connection error
+    and may be retried."""
+    if not isinstance(error, HttpError):
+        return True
+    return error.resp.status == TOO_MANY_REQUESTS or error.resp.status >= 500
+
+
+class DriveUploader:
+    """Uploads files to Google Drive and shares them with anyone with the link.
+
+    The Drive client and its credentials are built once and reused for every
+    upload. httplib2 connections cannot be shared between threads, so each
+    thread gets its own one from http_factory. Files larger than
+    DriveConfig.RESUMABLE_SIZE are sent in resumable uploads, so a failed
+    request only resends its chunk. Requests failing with 429 or 5xx are
+    retried DriveConfig.RETRIES times with exponential backoff.
+
+    The sharing permissions are queued and sent in batch requests of
+    batch_size calls, DriveConfig.BATCH_SIZE by default, from the thread
+    calling upload_files, share or share_pending. Permissions that could not
+    be created are kept in share_errors.
+
+    Use from_http to run against googleapiclient.http.HttpMock or
+    HttpMockSequence instead of the Drive API.
+    """
+
+    def __init__(self, service, batch_size: int | None = None,
+                 http_factory: Callable[[], httplib2.Http] | None = None):
+        self.service = service
+        self.batch_size = batch_size or DriveConfig.BATCH_SIZE.value
+        self.http_factory = http_factory
+        self.share_errors: dict[str, Exception] = {}
+        self._pending_shares: list[str] = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @classmethod
+    def from_service_account_file(cls, path: Path | None = None,
+                                  batch_size: int | None = None) -> 'DriveUploader':
+        if path is None:
+            path = DriveConfig.SERVICE_ACCOUNT_FILE.value
+        credentials = service_account.Credentials.from_service_account_file(
+            str(path), scopes=list(DriveConfig.SCOPES.value))
+        service = build('drive', 'v3', credentials=credentials,
+                        cache_discovery=False)
+        return cls(service, batch_size,
+                   lambda: AuthorizedHttp(credentials, http=httplib2.Http()))
+
+    @classmethod
+    def from_http(cls, http, batch_size: int | None = None) -> 'DriveUploader':
+        """Builds the client on http with the discovery document shipped
+        with googleapiclient, so no request is made until the first upload."""
+        service = build('drive', 'v3', http=http, static_discovery=True)
+        return cls(service, batch_size, lambda: http)
+
+    def _http(self) -> httplib2.Http | None:
+        """Returns the connection of the current thread."""
+        if self.http_factory is None:
+            return None
+        if not hasattr(self._local, 'http'):
+            self._local.http = self.http_factory()
+        return self._local.http
+
+    def upload(self, name: str, file: BinaryIO, mimetype: str) -> str:
+        """Uploads file as name and returns its Drive id.
+
+        The file is queued to be shared by the next batch of permissions,
+        sent by upload_files, share or share_pending.
+        """
+        size = file.seek(0, os.SEEK_END)
+        file.seek(0)
+        # Small files take a single request instead of the two a resumable
+        # upload needs at least
+        is_resumable = size > DriveConfig.RESUMABLE_SIZE.value
+        media = MediaIoBaseUpload(file, mimetype=mimetype,
+                                  chunksize=DriveConfig.CHUNKSIZE.value,
+                                  resumable=is_resumable)
+        request = self.service.files().create(body={'name': name},
+                                              media_body=media,
+                                              fields='id')
+        if is_resumable:
+            drive_file = None
+            while drive_file is None:
+                _, drive_file = request.next_chunk(
+                    http=self._http(), num_retries=DriveConfig.RETRIES.value)
+        else:
+            drive_file = request.execute(http=self._http(),
+                                         num_retries=DriveConfig.RETRIES.value)
+
+        with self._lock:
+            self._pending_shares.append(drive_file['id'])
+        return drive_file['id']
+
+    def share(self, file_id: str) -> None:
+        """Queues file_id to be shared, sharing the batch once it is full."""
+        with self._lock:
+            self._pending_shares.append(file_id)
+        self._share_full_batch()
+
+    def _share_full_batch(self) -> None:
+        with self._lock:
+            is_batch_full = len(self._pending_shares) >= self.batch_size
+        if is_batch_full:
+            self.share_pending()
+
+    def share_pending(self) -> None:
+        """Shares the uploaded files not shared yet in a single batch request.
+
+        Calls failing with 429, 5xx or a connection error are sent again in
+        a new batch, with the same backoff as the other requests. When the
+        batch request itself fails, every file of the batch is taken as not
+        shared.
+        """
+        with self._lock:
+            file_ids = list(dict.fromkeys(self._pending_shares))
+            self._pending_shares = []
+        errors: dict[str, Exception] = {}
+        attempt_errors: dict[str, Exception] = {}
+
+        def on_shared(request_id, response, exception):
+            if exception is not None:
+                attempt_errors[request_id] = exception
+
+        for retry in range(DriveConfig.RETRIES.value + 1):
+            if not file_ids:
+                break
+            if retry > 0:
+                time.sleep(random.random() * 2**retry)
+            attempt_errors.clear()
+            batch = self.service.new_batch_http_request(callback=on_shared)
+            for file_id in file_ids:
+                batch.add(self.service.permissions().create(fileId=file_id,
+                                                            body=ANYONE_READER,
+                                                            fields='id'),
+                          request_id=file_id)
+            try:
+                batch.execute(http=self._http())
+            except REQUEST_ERRORS as error:
+                attempt_errors.update(dict.fromkeys(file_ids, error))
+            for file_id in file_ids:
+                errors.pop(file_id, None)
+            errors.update(attempt_errors)
+            file_ids = [file_id for file_id, error in attempt_errors.items()
+                        if is_retryable(error)]
+
+        with self._lock:
+            self.share_errors.update(errors)
+
+    def upload_files(self, paths: Iterable[Path], mimetypes: dict[str, str],
+                     workers: int | None = None,
+                     on_uploaded: Callable[[Path, str], None] | None = None
+                     ) -> UploadReport:
+        """Uploads and shares the files in paths on workers threads.
+
+        mimetypes maps lower case file suffixes to MIME types. on_uploaded is
+        called, from the calling thread, with the path and Drive id of each
+        file as soon as it is uploaded, before it is shared. Permissions are
+        sent from the calling thread too, so a failed share never fails an
+        upload. Files that could not be uploaded or shared are reported as
+        failures instead of being given a Drive id.
+        """
+        if workers is None:
+            workers = DriveConfig.WORKERS.value
+        drive_ids = {}
+        failures = []
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(self._upload_path, Path(path), mimetypes): Path(path)
+                       for path in paths}
+            for future in as_completed(futures):
+                try:
+                    drive_ids[futures[future]] = future.result()
+                except REQUEST_ERRORS as error:
+                    failures.append(UploadFailure(futures[future], error))
+                    continue
+                if on_uploaded is not None:
+                    on_uploaded(futures[future], drive_ids[futures[future]])
+                self._share_full_batch()
+        self.share_pending()
+
+        for path, drive_id in list(drive_ids.items()):
+            if drive_id in self.share_errors:
+                failures.append(UploadFailure(path, self.share_errors[drive_id]))
+                del drive_ids[path]
+        return UploadReport(drive_ids, failures)
+
+    def _upload_path(self, path: Path, mimetypes: dict[str, str]) -> str:
+        with path.open('rb') as file:
+            return self.upload(path.name, file, mimetypes[path.suffix.lower()])
+
+    def close(self) -> None:
+        self.share_pending()
+
+    def __enter__(self) -> 'DriveUploader':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+class UploadLedger:
+    """Records the files already on Drive, keyed by content hash.
+
+    Entries hold the file name, Drive id, view URL and whether the file is
+    shared yet. The ledger is an append-only JSON lines file, written as
+    soon as each entry changes, so an interrupted run loses nothing; when a
+    hash appears more than once, its last line wins.
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.entries: dict[str, dict] = {}
+        if self.path.exists():
+            with open(self.path, 'r', encoding='utf8') as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.entries[entry['hash']] = entry
+
+    def get(self, content_hash: str) -> dict | None:
+        return self.entries.get(content_hash)
+
+    def record(self, content_hash: str, name: str, drive_id: str,
+               shared: bool = False) -> None:
+        self._append({
+            'hash': content_hash,
+            'name': name,
+            'drive_id': drive_id,
+            'url': DriveConfig.VIEW_BASE_URL.value.format(drive_id),
+            'shared': shared,
+        })
+
+    def mark_shared(self, content_hash: str) -> None:
+        self._append({**self.entries[content_hash], 'shared': True})
+
+    def _append(self, entry: dict) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, 'a', encoding='utf8') as f:
+            f.write(json.dumps(entry, sort_keys=True) + '\n')
+        self.entries[entry['hash']] = entry
+
+
+def upload_new_files(uploader: DriveUploader, ledger: UploadLedger,
+                     paths: Iterable[Path], mimetypes: dict[str, str],
+                     workers: int | None = None) -> UploadReport:
+    """Uploads the files in paths whose content is not in ledger yet.
+
+    Files uploaded by a previous run but not shared, e.g. because it was
+    interrupted, are shared without being uploaded again. Returns the Drive
+    ids of every file in paths that is uploaded and shared, whether by this
+    run or a previous one, and the failures of this run.
+    """
+    paths = [Path(path) for path in paths]
+    content_hashes = {path: file_hash(path) for path in paths}
+
+    for path in paths:
+        entry = ledger.get(content_hashes[path])
+        if entry is not None and not entry['shared']:
+            uploader.share(entry['drive_id'])
+    uploader.share_pending()
+
+    # Files with the same content are uploaded once
+    new_paths = {}
+    for path in paths:
+        if ledger.get(content_hashes[path]) is None:
+            new_paths.setdefault(content_hashes[path], path)
+    new_paths = list(new_paths.values())
+    report = uploader.upload_files(
+        new_paths, mimetypes, workers,
+        on_uploaded=lambda path, drive_id: ledger.record(content_hashes[path],
+                                                         path.name, drive_id))
+
+    drive_ids = {}
+    failures = list(report.failures)
+    for path in paths:
+        entry = ledger.get(content_hashes[path])
+        if entry is None:
+            continue
+        if entry['drive_id'] in uploader.share_errors:
+            if path not in new_paths:
+                failures.append(UploadFailure(
+                    path, uploader.share_errors[entry['drive_id']]))
+            continue
+        if not entry['shared']:
+            ledger.mark_shared(content_hashes[path])
+        drive_ids[path] = entry['drive_id']
+    return UploadReport(drive_ids, failures)
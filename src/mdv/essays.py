@@ -0,0 +1,445 @@
+from concurrent.futures import Executor, ProcessPoolExecutor
+from hashlib import sha256
+from io import BytesIO
+from pathlib import Path
+from typing import BinaryIO, Iterable, NamedTuple, Sequence
+import shutil
+
+from PIL import Image
+import numpy as np
+import pandas as pd
+
+from mdv.config import EssaySchemas, EssaysConfig
+from mdv.manifest import Manifest, file_hash
+from mdv.transforms import apply_schema
+
+FINGERPRINT_LENGTH = 16
+MANIFEST_FILENAME = 'manifest.json'
+OUTPUTS_VERSION = '1'
+# Bytes held per pixel while processing a scan: the decoded scan, its RGB
+# crop and a working copy for the encoder
+PROCESSING_BYTES_PER_PIXEL = 10
+
+# Suffix and MIME type of each output encoding
+ENCODINGS = {
+    'png'    : ('.png',  'image/png'),
+    'grey'   : ('.png',  'image/png'),
+    'bilevel': ('.png',  'image/png'),
+    'palette': ('.png',  'image/png'),
+    'webp'   : ('.webp', 'image/webp'),
+    'jpeg'   : ('.jpg',  'image/jpeg'),
+}
+
+
+class EssayResult(NamedTuple):
+    source          : Path
+    output          : Path
+    needs_revision  : bool
+    skipped         : bool = False
+
+
+def parse_essay_forms(essays_df: pd.DataFrame, exam_name: str) -> pd.DataFrame:
+    """Selects and casts the essay information of the answers in essays_df
+    according to EssaySchemas.
+
+    As in stage a, columns with values that cannot be cast, e.g. free text
+    answered for ano, keep their dtype.
+    """
+    return apply_schema(essays_df, EssaySchemas[exam_name.upper()].value,
+                        errors='ignore')
+
+
+def encode_image(image: Image.Image, fp: Path | BinaryIO,
+                 encoding: str, quality: int | None = None) -> None:
+    """Saves an RGB image to fp in one of the ENCODINGS.
+
+    'png' keeps full colour with default settings. 'grey' and 'bilevel'
+    drop colour, the latter thresholding at quality, and 'palette' quantizes
+    to quality colours; all three are saved as optimized PNGs. 'webp' and
+    progressive 'jpeg' are lossy with the given quality.
+    """
+    if quality is None:
+        quality = EssaysConfig.QUALITY.value.get(encoding)
+    if encoding == 'png':
+        image.save(fp, format='PNG')
+    elif encoding == 'grey':
+        image.convert('L').save(fp, format='PNG', optimize=True)
+    elif encoding == 'bilevel':
+        bilevel_image = image.convert('L').point(
+            lambda value: 255 if value >= quality else 0, mode='1')
+        bilevel_image.save(fp, format='PNG', optimize=True)
+    elif encoding == 'palette':
+        image.quantize(colors=quality).save(fp, format='PNG', optimize=True)
+    elif encoding == 'webp':
+        image.save(fp, format='WEBP', quality=quality, method=6)
+    elif encoding == 'jpeg':
+        image.save(fp, format='JPEG', quality=quality,
+                   optimize=True, progressive=True)
+    else:
+        raise ValueError(f'Unknown encoding {encoding}')
+
+
+def essay_fingerprint(image_path: Path, exam_name: str, encoding: str,
+                      detect: bool = False) -> str:
+    """Hashes the scan content together with the cropping and encoding
+    settings, including the header detection ones when detect is set."""
+    header_detection = (sorted(EssaysConfig.HEADER_DETECTION.value.items())
+                        if detect else None)
+    settings = repr((EssaysConfig.ASPECT_RATIO.value[exam_name],
+                     EssaysConfig.THRESHOLD.value[exam_name],
+                     EssaysConfig.NORMALIZED_CROP_HEIGHT.value[exam_name],
+                     detect,
+                     header_detection,
+                     EssaysConfig.MAX_SIZE.value,
+                     EssaysConfig.MEMORY_BUDGET.value,
+                     encoding,
+                     EssaysConfig.QUALITY.value.get(encoding)))
+    fingerprint = sha256((file_hash(image_path) + settings).encode('utf8'))
+    return fingerprint.hexdigest()[:FINGERPRINT_LENGTH]
+
+
+def essay_output_paths(image_path: Path,
+                       essay_information: list[str],
+                       exam_name: str,
+                       output_dir: Path,
+                       encoding: str,
+                       detect: bool = False) -> tuple[Path, Path]:
+    """Returns the no-revision and revision output paths of a scan.
+
+    Names are built from the essay information and the scan fingerprint, so
+    they are the same on every run with the same settings.
+    """
+    image_path = Path(image_path)
+    image_filename = ('-'.join(essay_information) + '_'
+                      + essay_fingerprint(image_path, exam_name, encoding, detect))
+    no_revision_suffix, _ = ENCODINGS[encoding]
+    no_revision_path = (output_dir / EssaysConfig.NO_REVISION_DIR.value
+                        / (image_filename+no_revision_suffix))
+    revision_path = (output_dir / EssaysConfig.REVISION_DIR.value
+                     / (image_filename+image_path.suffix.lower()))
+    return no_revision_path, revision_path
+
+
+def size_limit(size: tuple[int, int]) -> tuple[int, int]:
+    """Returns the largest size, within EssaysConfig.MAX_SIZE and
+    MEMORY_BUDGET, of a scan of the given size, keeping its aspect ratio."""
+    width, height = size
+    scale = 1.0
+    max_size = EssaysConfig.MAX_SIZE.value
+    if max_size is not None:
+        scale = min(scale, max_size[0]/width, max_size[1]/height)
+    memory_budget = EssaysConfig.MEMORY_BUDGET.value
+    if memory_budget is not None:
+        max_pixels = memory_budget * 2**20 / PROCESSING_BYTES_PER_PIXEL
+        scale = min(scale, (max_pixels/(width*height)) ** 0.5)
+    return max(1, int(width*scale)), max(1, int(height*scale))
+
+
+def fits_memory_budget(image: Image.Image) -> bool:
+    """Tells whether decoding image, at its current draft size, fits
+    EssaysConfig.MEMORY_BUDGET."""
+    memory_budget = EssaysConfig.MEMORY_BUDGET.value
+    if memory_budget is None:
+        return True
+    decoded_bytes = image.width * image.height * len(image.getbands())
+    return decoded_bytes <= memory_budget * 2**20
+
+
+def open_scan(image_path: Path) -> Image.Image | None:
+    """Opens a scan reduced to size_limit before any other processing.
+
+    JPEG scans are reduced while decoding, at a power of two scale, and then
+    resized; other formats are decoded at full size first. Scans are only
+    decoded when a reduction is needed. Returns None when decoding the scan
+    would exceed EssaysConfig.MEMORY_BUDGET.
+    """
+    image = Image.open(image_path)
+    size = size_limit(image.size)
+    if size == image.size:
+        return image
+    image.draft(None, size)
+    if not fits_memory_budget(image):
+        image.close()
+        return None
+    image.thumbnail(size)
+    return image
+
+
+def load_thumbnail(image_path: Path) -> np.ndarray:
+    """Returns the scan as a greyscale thumbnail of EssaysConfig.HEADER_DETECTION size.
+
+    The scan is stretched to the thumbnail size, so rows are in normalized
+    height whatever the aspect ratio. JPEG scans are decoded at a reduced
+    scale.
+    """
+    settings = EssaysConfig.HEADER_DETECTION.value
+    size = (int(settings['width']), int(settings['height']))
+    with Image.open(image_path) as image:
+        image.draft('L', size)
+        if not fits_memory_budget(image):
+            # A blank thumbnail has no header, leaving the scan to process_essay
+            return np.full(size[::-1], 255, dtype=np.uint8)
+        thumbnail = image.convert('L').resize(size, Image.Resampling.BOX)
+    return np.asarray(thumbnail)
+
+
+def detect_header_ends(thumbnails: np.ndarray, exam_name: str) -> np.ndarray:
+    """Finds where the form header ends in a batch of thumbnails.
+
+    thumbnails has shape (scans, height, width). The header is closed by a
+    printed rule across the page, so the row-intensity profile of each scan
+    is the fraction of each row darker than the paper, and the header ends
+    below the most covered row around NORMALIZED_CROP_HEIGHT. Returns the
+    normalized crop height of each scan, NaN where no row is covered enough
+    to be a rule.
+    """
+    settings = EssaysConfig.HEADER_DETECTION.value
+    _, height, _ = thumbnails.shape
+    expected_row = round(EssaysConfig.NORMALIZED_CROP_HEIGHT.value[exam_name] * height)
+    radius = max(1, round(settings['search_window'] * height))
+    rows = np.arange(max(expected_row - radius, 0),
+                     min(expected_row + radius + 1, height))
+
+    windows = thumbnails[:, rows]
+    # The paper level of each scan is its median grey level, so dim or
+    # yellowed photos are handled like clean scans
+    paper = np.median(windows.reshape(len(windows), -1), axis=1)
+    is_dark = windows < (paper * (1 - settings['darkness']))[:, None, None]
+    coverage = is_dark.mean(axis=2)
+
+    peaks = coverage.argmax(axis=1)
+    is_found = coverage.max(axis=1) >= settings['min_coverage']
+    return np.where(is_found, (rows[peaks] + 1) / height, np.nan)
+
+
+def detect_headers(image_paths: Sequence[Path], exam_name: str,
+                   executor: Executor | None = None) -> list[float | None]:
+    """Detects the header end of each scan, see detect_header_ends.
+
+    Thumbnails are loaded on executor, when given, and detected
+    EssaysConfig.HEADER_DETECTION['batch_size'] scans at a time. Returns None
+    for scans whose header end was not found.
+    """
+    batch_size = int(EssaysConfig.HEADER_DETECTION.value['batch_size'])
+    map_thumbnails = map if executor is None else executor.map
+    crop_heights = []
+    for start in range(0, len(image_paths), batch_size):
+        batch_paths = image_paths[start:start+batch_size]
+        thumbnails = np.stack(list(map_thumbnails(load_thumbnail, batch_paths)))
+        header_ends = detect_header_ends(thumbnails, exam_name)
+        crop_heights.extend(None if np.isnan(header_end) else float(header_end)
+                            for header_end in header_ends)
+    return crop_heights
+
+
+def crop_header(image: Image.Image, exam_name: str,
+                crop_height: float | None = None) -> Image.Image | None:
+    """Returns the scan without its form header as RGB.
+
+    crop_height is a normalized height found by detect_headers, used when
+    it is within EssaysConfig.HEADER_DETECTION['max_offset'] of the exam's
+    expected one. Otherwise, only the image header is read to decide and
+    None is returned when the aspect ratio does not match the exam's
+    expected one, meaning the scan needs manual revision.
+    """
+    expected_ratio = EssaysConfig.ASPECT_RATIO.value[exam_name]
+    threshold = EssaysConfig.THRESHOLD.value[exam_name]
+    normalized_crop_height = EssaysConfig.NORMALIZED_CROP_HEIGHT.value[exam_name]
+    max_offset = EssaysConfig.HEADER_DETECTION.value['max_offset']
+
+    width, height = image.size
+    aspect_ratio = float(width)/float(height)
+    if (crop_height is not None
+            and abs(crop_height - normalized_crop_height) <= max_offset):
+        normalized_crop_height = crop_height
+    elif abs(aspect_ratio-expected_ratio) >= threshold:
+        return None
+    crop_height = int(normalized_crop_height * height)
+    return image.crop((0, crop_height, width, height)).convert('RGB')
+
+
+def exam_output_dirs(output_dir: Path) -> tuple[Path, Path]:
+    """Creates and returns the no-revision and revision directories."""
+    no_revision_dir = output_dir / EssaysConfig.NO_REVISION_DIR.value
+    revision_dir = output_dir / EssaysConfig.REVISION_DIR.value
+    no_revision_dir.mkdir(parents=True, exist_ok=True)
+    revision_dir.mkdir(parents=True, exist_ok=True)
+    return no_revision_dir, revision_dir
+
+
+def process_essay(image_path: Path,
+                  essay_information: list[str],
+                  exam_name: str,
+                  output_dir: Path,
+                  encoding: str | None = None,
+                  crop_height: float | None = None,
+                  detect: bool = False) -> EssayResult:
+    """Crops the form header from an essay scan.
+
+    Scans with a plausible detected crop_height or whose aspect ratio
+    matches the exam's expected one are cropped (see crop_header) and saved
+    in encoding, EssaysConfig.ENCODING by default, to the no-revision
+    directory. Any other scan is copied byte for byte, with its original
+    extension, to the revision directory for manual handling, as is any
+    scan that cannot be decoded within EssaysConfig.MEMORY_BUDGET (see
+    open_scan). Scans already processed by a previous run with the same
+    settings are skipped, including those moved to the duplicate directory
+    by mdv.dedup. detect tells whether crop_height comes from header
+    detection, which is part of the settings.
+    """
+    if encoding is None:
+        encoding = EssaysConfig.ENCODING.value
+    image_path = Path(image_path)
+    no_revision_path, revision_path = essay_output_paths(
+        image_path, essay_information, exam_name, output_dir, encoding, detect)
+    if no_revision_path.exists():
+        return EssayResult(image_path, no_revision_path, False, skipped=True)
+    duplicate_path = (output_dir / EssaysConfig.DUPLICATE_DIR.value
+                      / no_revision_path.name)
+    if duplicate_path.exists():
+        return EssayResult(image_path, duplicate_path, False, skipped=True)
+    if revision_path.exists():
+        return EssayResult(image_path, revision_path, True, skipped=True)
+
+    image = open_scan(image_path)
+    if image is not None:
+        with image:
+            new_image = crop_header(image, exam_name, crop_height)
+        if new_image is not None:
+            # Written under a temporary name so interrupted runs leave no
+            # output that would be mistaken for a finished one
+            partial_path = no_revision_path.with_name(no_revision_path.name + '.part')
+            encode_image(new_image, partial_path, encoding)
+            partial_path.replace(no_revision_path)
+            return EssayResult(image_path, no_revision_path, False)
+
+    partial_path = revision_path.with_name(revision_path.name + '.part')
+    shutil.copyfile(image_path, partial_path)
+    partial_path.replace(revision_path)
+    return EssayResult(image_path, revision_path, True)
+
+
+def supersede_outputs(results: Iterable[EssayResult], output_dir: Path) -> list[Path]:
+    """Deletes the outputs written for the scans of results by earlier runs
+    with other settings, and returns their paths.
+
+    Output names change with the fingerprint (see essay_fingerprint), so
+    the current output of each scan is recorded in the manifest of
+    output_dir. Any other output recorded for the scan is deleted from the
+    no-revision, revision and duplicate directories, so it is not uploaded
+    next to the current one.
+    """
+    manifest = Manifest(output_dir / MANIFEST_FILENAME, OUTPUTS_VERSION)
+    output_dirs = [output_dir / EssaysConfig.NO_REVISION_DIR.value,
+                   output_dir / EssaysConfig.REVISION_DIR.value,
+                   output_dir / EssaysConfig.DUPLICATE_DIR.value]
+    deleted_paths = []
+    for result in results:
+        entry = manifest.entries.get(result.source.name)
+        if entry is not None and entry['metadata']['output'] != result.output.name:
+            for directory in output_dirs:
+                previous_path = directory / entry['metadata']['output']
+                if previous_path.exists():
+                    previous_path.unlink()
+                    deleted_paths.append(previous_path)
+        fingerprint = result.output.stem.rsplit('_', 1)[-1]
+        manifest.record(result.source.name, fingerprint, [],
+                        {'output': result.output.name})
+    manifest.save()
+    return deleted_paths
+
+
+def process_essays(essays_df: pd.DataFrame,
+                   exam_name: str,
+                   output_dir: Path,
+                   workers: int = 1,
+                   encoding: str | None = None,
+                   detect: bool = True) -> list[EssayResult]:
+    """Processes every essay in essays_df, spreading them over workers processes.
+
+    essays_df holds the essay information columns plus a filepath column.
+    With detect set, the header end of the scans not yet processed is
+    detected first (see detect_headers) and used for cropping, falling back
+    to the aspect ratio check where it is not found or implausible (see
+    crop_header). Turning detection on or off changes the output names, so
+    scans processed without it, including those sent to revision, are
+    processed again. Results are returned in the order of essays_df.
+    Outputs of earlier runs with other settings are deleted, see
+    supersede_outputs.
+    """
+    exam_output_dirs(output_dir)
+    image_paths = list(essays_df.filepath)
+    essays_information = (essays_df.drop(columns='filepath')
+                                   .astype(str).values.tolist())
+    exam_names = [exam_name] * len(image_paths)
+    output_dirs = [output_dir] * len(image_paths)
+    encodings = [encoding] * len(image_paths)
+    crop_heights = [None] * len(image_paths)
+    detects = [detect] * len(image_paths)
+
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        if detect:
+            pending = [
+                index for index, (image_path, essay_information)
+                in enumerate(zip(image_paths, essays_information))
+                if not any(path.exists() for path in essay_output_paths(
+                    image_path, essay_information, exam_name, output_dir,
+                    encoding or EssaysConfig.ENCODING.value, detect))
+            ]
+            pending_crop_heights = detect_headers(
+                [image_paths[index] for index in pending], exam_name, executor)
+            for index, crop_height in zip(pending, pending_crop_heights):
+                crop_heights[index] = crop_height
+
+        map_essays = map if executor is None else executor.map
+        results = list(map_essays(process_essay, image_paths, essays_information,
+                                  exam_names, output_dirs, encodings, crop_heights,
+                                  detects))
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    superseded_paths = supersede_outputs(results, output_dir)
+    if superseded_paths:
+        print(f'Deleted {len(superseded_paths)} outputs of earlier settings')
+    return results
+
+
+def cropped_bytes(results: Iterable[EssayResult]) -> tuple[int, int]:
+    """Returns the total size of the scans of the cropped results and of
+    their outputs.
+
+    Scans are often compressed more than their outputs, so the outputs may
+    be larger; see compare_encodings for the savings of each encoding over
+    the full-colour PNG.
+    """
+    cropped = [result for result in results if not result.needs_revision]
+    return (sum(result.source.stat().st_size for result in cropped),
+            sum(result.output.stat().st_size for result in cropped))
+
+
+def compare_encodings(image_paths: Iterable[Path], exam_name: str,
+                      encodings: Iterable[str] = ENCODINGS) -> pd.DataFrame:
+    """Encodes the cropped scans in memory with each encoding.
+
+    Returns the total size of each encoding and the bytes it saves compared
+    to the full-colour PNG, to help pick EssaysConfig.ENCODING.
+    """
+    encodings = list(encodings)
+    sizes = dict.fromkeys(['png', *encodings], 0)
+    for image_path in image_paths:
+        image = open_scan(image_path)
+        if image is None:
+            continue
+        with image:
+            cropped_image = crop_header(image, exam_name)
+            if cropped_image is None:
+                continue
+            for encoding in sizes:
+                buffer = BytesIO()
+                encode_image(cropped_image, buffer, encoding)
+                sizes[encoding] += buffer.tell()
+
+    sizes_df = pd.DataFrame({'bytes': pd.Series(sizes)}).loc[encodings]
+    sizes_df['bytes_saved'] = sizes['png'] - sizes_df['bytes']
+    return sizes_df
@@ -0,0 +1,151 @@
+from concurrent.futures import ProcessPoolExecutor
+from hashlib import sha256
+from pathlib import Path
+from typing import NamedTuple
+
+import pandas as pd
+
+from mdv.config import DataDirectories, Exams, FormSchemas, StorageConfig
+from mdv.manifest import Manifest, file_hash
+from mdv.storage import TableWriter, table_path
+from mdv.transforms import apply_schema, coalesce_columns
+
+UNIDADE_REGEX = r'^Unidade|unidade \('
+CURSO_REGEX = r'Curso'
+ID_REGEX = r'\((\d+)\)'
+
+# Bump whenever the parsing logic changes so every form is parsed again
+PARSER_VERSION = 1
+MANIFEST_FILENAME = 'manifest.json'
+
+
+class FormsReport(NamedTuple):
+    output_paths    : list[Path]
+    # Names of the forms skipped as unchanged since the last run
+    skipped         : list[str]
+
+
+def parser_version() -> str:
+    """Identifies the parsing logic, the exam schemas and the output format."""
+    schemas = repr([(schema.name, schema.value) for schema in FormSchemas])
+    schemas_hash = sha256(schemas.encode('utf8')).hexdigest()[:16]
+    return f'{PARSER_VERSION}-{StorageConfig.REVIEW_FORMAT.value}-{schemas_hash}'
+
+
+def parse_course_columns(form_df: pd.DataFrame) -> pd.DataFrame:
+    """Merges the split Unidade and Curso columns into id, unidade and curso."""
+    unidade_series = coalesce_columns(form_df, UNIDADE_REGEX)
+    curso_series = coalesce_columns(form_df, CURSO_REGEX)
+
+    id_series = curso_series.str.extract(
+        ID_REGEX, expand=False)
+    curso_series = curso_series.str.replace(
+        ID_REGEX, '', regex=True).str.strip()
+
+    return pd.DataFrame({
+        'id': id_series,
+        'unidade': unidade_series,
+        'curso': curso_series,
+    }).astype('string')
+
+
+def parse_exam_results(form_df: pd.DataFrame,
+                       unidade_curso_df: pd.DataFrame,
+                       exam: Exams) -> pd.DataFrame:
+    exam_mask = form_df['Forma de ingresso'].str.contains(exam.value)
+    exam_raw = form_df[exam_mask]
+
+    exam_data = apply_schema(exam_raw, FormSchemas[exam.name].value,
+                             errors='ignore')
+    exam_results = pd.concat([unidade_curso_df[exam_mask], exam_data],
+                             axis=1)
+    return exam_results.convert_dtypes()
+
+
+def exam_output_path(data_directories: DataDirectories,
+                     exam: Exams, form_path: Path) -> Path:
+    output_dir = data_directories.TWO.value / 'forms' / exam.name.lower()
+    return table_path(output_dir / form_path.stem, StorageConfig.REVIEW_FORMAT.value)
+
+
+def parse_form(form_path: Path,
+               data_directories: DataDirectories,
+               exams: Exams,
+               chunksize: int | None = None) -> list[Path]:
+    """Parses a single yearly form, writing one table per exam.
+
+    With chunksize set, the form is read chunksize rows at a time and the
+    results are appended to the exam tables, so memory use does not grow with
+    the number of responses.
+    """
+    output_paths = [exam_output_path(data_directories, exam, form_path)
+                    for exam in exams]
+    if chunksize is None:
+        form_chunks = [pd.read_csv(form_path)]
+    else:
+        form_chunks = pd.read_csv(form_path, chunksize=chunksize)
+
+    writers = [TableWriter(output_path, StorageConfig.REVIEW_FORMAT.value)
+               for output_path in output_paths]
+    try:
+        for form_df in form_chunks:
+            unidade_curso_df = parse_course_columns(form_df)
+            for exam, writer in zip(exams, writers):
+                writer.write(parse_exam_results(form_df, unidade_curso_df, exam))
+    finally:
+        for writer in writers:
+            writer.close()
+    return output_paths
+
+
+def parse_forms(data_directories: DataDirectories,
+                exams: Exams,
+                workers: int = 1,
+                force: bool = False,
+                chunksize: int | None = None) -> FormsReport:
+    """Parses every form in 1_initial/forms into 2_intermediate/forms.
+
+    Forms whose content, outputs and parser version match the manifest in
+    2_intermediate/forms are skipped unless force is set, and returned with
+    the written paths. With workers > 1,
+    each form is parsed in its own process, which reads it once and writes
+    the tables of every exam. The output is the same as the serial path.
+    See parse_form for chunksize.
+    """
+    input_dir = data_directories.ONE.value / 'forms'
+    output_dir = data_directories.TWO.value / 'forms'
+    manifest = Manifest(output_dir / MANIFEST_FILENAME, parser_version())
+
+    form_hashes = {}
+    skipped = []
+    for form_path in sorted(input_dir.iterdir()):
+        form_hash = file_hash(form_path)
+        if not force and manifest.is_up_to_date(form_path.name, form_hash):
+            print(f'Skipping {form_path.stem}: unchanged since last run')
+            skipped.append(form_path.stem)
+        else:
+            form_hashes[form_path] = form_hash
+    form_paths = list(form_hashes)
+
+    if workers <= 1:
+        output_paths = []
+        for form_path in form_paths:
+            output_paths.extend(parse_form(form_path, data_directories, exams,
+                                           chunksize))
+    else:
+        exams = tuple(exams)
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(parse_form,
+                                   form_paths,
+                                   [data_directories] * len(form_paths),
+                                   [exams] * len(form_paths),
+                                   [chunksize] * len(form_paths))
+            output_paths = [path for paths in results for path in paths]
+
+    for form_path, form_hash in form_hashes.items():
+        form_outputs = [exam_output_path(data_directories, exam, form_path)
+                        for exam in exams]
+        manifest.record(form_path.name, form_hash, form_outputs)
+    manifest.save()
+
+    return FormsReport(output_paths, skipped)
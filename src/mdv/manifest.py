@@ -0,0 +1,69 @@
+from hashlib import sha256
+from pathlib import Path
+from typing import Iterable
+import json
+
+HASH_CHUNK_SIZE = 1 << 20
+
+
+def file_hash(path: Path) -> str:
+    """Returns the SHA-256 hex digest of the file content."""
+    digest = sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Manifest:
+    """Records input and output hashes of a pipeline stage in a JSON file.
+
+    An entry is up to date when its input hash and the stage version match
+    the recorded ones and all of its outputs still exist with the recorded
+    content. Output paths are stored relative to the manifest directory.
+    Stages may keep extra information about an entry in its metadata.
+    """
+
+    def __init__(self, path: Path, version: str):
+        self.path = Path(path)
+        self.version = version
+        self.entries: dict[str, dict] = {}
+        if self.path.exists():
+            with open(self.path, 'r', encoding='utf8') as f:
+                content = json.load(f)
+            if content.get('version') == version:
+                self.entries = content.get('entries', {})
+
+    def _relative(self, path: Path) -> str:
+        return Path(path).resolve().relative_to(self.path.parent.resolve()).as_posix()
+
+    def is_up_to_date(self, key: str, input_hash: str) -> bool:
+        entry = self.entries.get(key)
+        if entry is None or entry['input'] != input_hash:
+            return False
+        for output, output_hash in entry['outputs'].items():
+            output_path = self.path.parent / output
+            if not output_path.exists() or file_hash(output_path) != output_hash:
+                return False
+        return True
+
+    def record(self, key: str, input_hash: str,
+               output_paths: Iterable[Path],
+               metadata: dict | None = None) -> None:
+        self.entries[key] = {
+            'input': input_hash,
+            'outputs': {
+                self._relative(output_path): file_hash(output_path)
+                for output_path in output_paths
+            },
+            'metadata': metadata or {},
+        }
+
+    def remove(self, key: str) -> None:
+        self.entries.pop(key, None)
+
+    def save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, 'w', encoding='utf8') as f:
+            json.dump({'version': self.version, 'entries': self.entries},
+                      f, indent=2, sort_keys=True)
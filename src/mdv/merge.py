@@ -0,0 +1,174 @@
+from pathlib import Path
+from typing import Sequence
+
+import pandas as pd
+
+from mdv.config import StorageConfig
+from mdv.manifest import Manifest, file_hash
+from mdv.storage import (TableWriter, count_rows, find_table, iter_table_chunks,
+                         read_table, read_table_columns, table_path, write_table)
+
+# Bump whenever the merging logic changes so every table is merged again
+MERGE_VERSION = 2
+MANIFEST_FILENAME = 'manifest.json'
+
+
+def merge_version() -> str:
+    return f'{MERGE_VERSION}-{StorageConfig.FORMAT.value}'
+
+
+def merged_columns(input_paths: Sequence[Path]) -> list[str]:
+    """Returns the union of the table columns, in order of appearance."""
+    columns = []
+    for input_path in input_paths:
+        for column in read_table_columns(input_path):
+            if column not in columns:
+                columns.append(column)
+    return columns
+
+
+def concat_tables(dfs: Sequence[pd.DataFrame]) -> pd.DataFrame:
+    """Concatenates tables, keeping columns typed differently across them
+    as text."""
+    merged_df = pd.concat(dfs, ignore_index=True)
+    mixed_columns = merged_df.select_dtypes('object').columns
+    return merged_df.astype({column: 'string' for column in mixed_columns})
+
+
+def table_dtypes(df: pd.DataFrame) -> list[tuple[str, str]]:
+    """Returns the (column, dtype) of each column of df, in order."""
+    return [(column, str(dtype)) for column, dtype in df.dtypes.items()]
+
+
+def merge_tables(input_paths: Sequence[Path], output_path: Path,
+                 chunksize: int | None = None) -> Path:
+    """Concatenates the tables in input_paths into output_path.
+
+    With chunksize set, each table is streamed chunksize rows at a time and
+    appended to the output, so memory use does not grow with the number of
+    rows. Columns missing from a table are left empty in both modes. Values
+    are written as read, so integer columns are not upcast to float when
+    another table holds missing values, as pd.concat does.
+    """
+    if chunksize is None:
+        merged_df = concat_tables([read_table(input_path)
+                                   for input_path in input_paths])
+        return write_table(merged_df, output_path)
+
+    columns = merged_columns(input_paths)
+    with TableWriter(output_path) as writer:
+        for input_path in input_paths:
+            for chunk_df in iter_table_chunks(input_path, chunksize):
+                writer.write(chunk_df.reindex(columns=columns))
+        if writer.chunks_written == 0:
+            writer.write(pd.DataFrame(columns=columns))
+    return writer.path
+
+
+def restore_dtypes(merged_slice_df: pd.DataFrame,
+                   dtypes: Sequence[tuple[str, str]]) -> pd.DataFrame:
+    """Takes the columns of an input table back out of its rows in a merged
+    table, cast to the dtypes the input table had.
+
+    Raises ValueError or TypeError when a column cannot be cast back.
+    """
+    columns = [column for column, _ in dtypes]
+    return merged_slice_df[columns].astype(dict(dtypes))
+
+
+def merge_changed_tables(input_paths: Sequence[Path], output_path: Path,
+                         keys: list[str], previous_keys: list[str],
+                         metadata: dict[str, dict],
+                         manifest: Manifest) -> pd.DataFrame | None:
+    """Merges the tables in input_paths, reading only those whose keys are
+    missing from metadata and taking the others from output_path.
+
+    The rows and dtypes of the changed tables are added to metadata. Returns
+    None when the unchanged tables cannot be restored from output_path, e.g.
+    when their dtypes were not recorded, so that they are merged again.
+    """
+    if any('dtypes' not in metadata[key] for key in metadata):
+        return None
+    previous_df = read_table(output_path)
+    previous_slices = {}
+    start = 0
+    for key in previous_keys:
+        rows = manifest.entries[key]['metadata']['rows']
+        previous_slices[key] = previous_df.iloc[start:start+rows]
+        start += rows
+
+    dfs = []
+    for key, input_path in zip(keys, input_paths):
+        if key in metadata:
+            try:
+                dfs.append(restore_dtypes(previous_slices[key], metadata[key]['dtypes']))
+            except (KeyError, TypeError, ValueError):
+                print(f'Cannot restore {key} from {output_path.name}, merging every table')
+                return None
+        else:
+            df = read_table(input_path)
+            metadata[key] = {'rows': len(df), 'dtypes': table_dtypes(df)}
+            dfs.append(df)
+    return concat_tables(dfs)
+
+
+def merge_tables_incremental(input_paths: Sequence[Path], output_path: Path,
+                             chunksize: int | None = None,
+                             force: bool = False) -> Path:
+    """Merges the tables in input_paths into output_path, like merge_tables,
+    reusing the rows of unchanged tables.
+
+    The content hash, row count, position and dtypes of each input table
+    are kept in a manifest next to output_path. When no table changed, the
+    output is left untouched. When some did, only the changed ones are read.
+    The rows of the unchanged ones are taken from the current output and
+    cast back to the dtypes of their tables (see restore_dtypes), so the
+    merged dtypes are worked out again from every table, as merge_tables
+    does. A column widened to text by a value that was since fixed thus
+    gets its own dtype back. Without a usable manifest, with force set,
+    with chunksize set, or when the rows of an unchanged table cannot be
+    cast back, every table is merged again.
+    """
+    input_paths = [find_table(input_path) for input_path in input_paths]
+    output_path = table_path(output_path)
+    manifest = Manifest(output_path.parent / MANIFEST_FILENAME, merge_version())
+
+    prefix = output_path.stem + '/'
+    keys = [prefix + input_path.name for input_path in input_paths]
+    input_hashes = {key: file_hash(input_path)
+                    for key, input_path in zip(keys, input_paths)}
+    previous_keys = sorted((key for key in manifest.entries if key.startswith(prefix)),
+                           key=lambda key: manifest.entries[key]['metadata']['position'])
+    unchanged_keys = {key for key in keys
+                      if manifest.is_up_to_date(key, input_hashes[key])}
+
+    if not force and previous_keys == keys and unchanged_keys == set(keys):
+        print(f'Skipping {output_path.stem}: unchanged since last run')
+        return output_path
+
+    metadata = {key: manifest.entries[key]['metadata'] for key in unchanged_keys}
+    merged_df = None
+    if not force and chunksize is None and unchanged_keys:
+        merged_df = merge_changed_tables(input_paths, output_path, keys,
+                                         previous_keys, metadata, manifest)
+    if merged_df is not None:
+        write_table(merged_df, output_path)
+        removed_count = len(set(previous_keys) - set(keys))
+        print(f'Updated {output_path.stem}: {len(keys) - len(unchanged_keys)} '
+              f'tables changed, {removed_count} removed')
+    elif chunksize is not None:
+        merge_tables(input_paths, output_path, chunksize)
+    else:
+        dfs = [read_table(input_path) for input_path in input_paths]
+        for key, df in zip(keys, dfs):
+            metadata[key] = {'rows': len(df), 'dtypes': table_dtypes(df)}
+        write_table(concat_tables(dfs), output_path)
+
+    for key in previous_keys:
+        manifest.remove(key)
+    for position, (key, input_path) in enumerate(zip(keys, input_paths)):
+        key_metadata = metadata.get(key, {'rows': count_rows(input_path)})
+        manifest.record(key, input_hashes[key], [output_path],
+                        {**key_metadata, 'position': position})
+    manifest.save()
+    return output_path
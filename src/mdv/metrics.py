@@ -0,0 +1,44 @@
+import pandas as pd
+
+GROUP_COLUMNS = ['id', 'ano', 'modalidade']
+VALUE_COLUMN = 'nota_final'
+AGGREGATIONS = {'min': 'Mínimo', 'max': 'Máximo', 'mean': 'Médio'}
+QUANTILES = {0.25: '1º quartil', 0.5: 'Mediana', 0.75: '3º quartil'}
+METRICS = [*AGGREGATIONS.values(), *QUANTILES.values()]
+
+
+def compute_metrics(exam_df: pd.DataFrame) -> pd.DataFrame:
+    """Computes the metrics of nota_final of every (id, ano, modalidade).
+
+    Returns a long table with one (id, ano, modalidade, count, metric, nota,
+    is_latest) row per group and metric, where count is the number of notas
+    of the group and is_latest tells whether ano is the latest year of the
+    course. The rows of each course are together, by metric in the order of
+    METRICS, then by ano and modalidade.
+    """
+    grouped = exam_df.groupby(GROUP_COLUMNS)[VALUE_COLUMN]
+    wide_df = grouped.agg(['count', *AGGREGATIONS]).rename(columns=AGGREGATIONS)
+    quantiles_df = grouped.quantile(list(QUANTILES)).unstack().rename(columns=QUANTILES)
+    wide_df = wide_df.join(quantiles_df).reset_index()
+
+    long_df = wide_df.melt(id_vars=[*GROUP_COLUMNS, 'count'],
+                           value_vars=METRICS,
+                           var_name='metric',
+                           value_name='nota')
+    long_df['nota'] = long_df['nota'].astype('Float64')
+    latest_years = long_df.groupby('id')['ano'].transform('max')
+    long_df['is_latest'] = long_df['ano'] == latest_years
+    return long_df.sort_values('id', kind='stable').reset_index(drop=True)
+
+
+def select_metrics(metrics_df: pd.DataFrame, metrics: list[str]) -> pd.DataFrame:
+    """Keeps the rows of metrics_df of the given metrics."""
+    return metrics_df.loc[metrics_df['metric'].isin(metrics)]
+
+
+def latest_metrics(metrics_df: pd.DataFrame) -> pd.DataFrame:
+    """Returns the metrics of the latest year of every course, with one
+    (id, ano, modalidade) row and one column per metric."""
+    latest_df = metrics_df.loc[metrics_df['is_latest']]
+    wide_df = latest_df.pivot(index=GROUP_COLUMNS, columns='metric', values='nota')
+    return wide_df[METRICS].reset_index().rename_axis(columns=None)
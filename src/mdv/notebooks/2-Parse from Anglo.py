@@ -14,9 +14,19 @@
 #     name: python3
 # ---
 
+# %%
+try:
+    from .helper import fix_path
+except ImportError:
+    from helper import fix_path
+fix_path()
+
 # %%
 import pandas as pd
 
+from mdv.config import Field
+from mdv.transforms import apply_schema
+
 # %%
 FORM_PATH = '/home/tomaz/Desktop/MDV/anglo.csv'
 RESULT_PATH = '/home/tomaz/Desktop/MDV/anglo_processed.csv'
@@ -35,24 +45,22 @@ anglo_raw.columns
 
 
 # %%
-def parse_fuvest_results(row):
-
-    return pd.Series({
-        'id':                     row['id'],
-        'ano':                    2022,
-        'modalidade':             row['MODALIDADE'],
-        'chamada':                'Primeira',
-        'nota_1':                 row['ACERTOS NA 1ª FASE'],
-        'nota_2_1':               row['NOTA NA 2ª FASE (1º DIA)'],
-        'nota_2_2':               row['NOTA NA 2ª FASE (2º DIA)'],
-        'nota_final':             row['NOTA FINAL'],
-        'nota_redacao':           row['REDAÇÃO'],
-        'classificacao_carreira': pd.NA,
-        'classificacao_curso':    row['CLASSIFICAÇÃO NA CARREIRA NA MODALIDADE DE INGRESSO'],
-        'redacao':                pd.NA,
-    })
-
-anglo_data = anglo_raw.apply(parse_fuvest_results, axis=1)
+ANGLO_SCHEMA = (
+    Field('id',                                                   'id',                     'Int64'),
+    Field(None,                                                   'ano',                    'Int64',  2022),
+    Field('MODALIDADE',                                           'modalidade',             'string'),
+    Field(None,                                                   'chamada',                'string', 'Primeira'),
+    Field('ACERTOS NA 1ª FASE',                                   'nota_1',                 'Int64'),
+    Field('NOTA NA 2ª FASE (1º DIA)',                             'nota_2_1',               'Float64'),
+    Field('NOTA NA 2ª FASE (2º DIA)',                             'nota_2_2',               'Float64'),
+    Field('NOTA FINAL',                                           'nota_final',             'Float64'),
+    Field('REDAÇÃO',                                              'nota_redacao',           'Float64'),
+    Field(None,                                                   'classificacao_carreira', 'Int64'),
+    Field('CLASSIFICAÇÃO NA CARREIRA NA MODALIDADE DE INGRESSO',  'classificacao_curso',    'Int64'),
+    Field(None,                                                   'redacao',                'string'),
+)
+
+anglo_data = apply_schema(anglo_raw, ANGLO_SCHEMA, errors='ignore')
 anglo_data.head()
 
 # %%
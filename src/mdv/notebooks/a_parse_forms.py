@@ -33,7 +33,9 @@ import os
 import pandas as pd
 import numpy as np
 
-from mdv.config import DataDirectories, Exams
+from mdv.config import DataDirectories, Exams, FormSchemas, FormsConfig
+from mdv.forms import parse_forms
+from mdv.transforms import apply_schema, coalesce_columns
 
 # %% [markdown]
 # ### Parameters
@@ -45,6 +47,10 @@ OUTPUR_DIR = DataDirectories.TWO.value / 'forms'
 print(INPUT_DIR)
 print(OUTPUR_DIR)
 
+# %%
+# Parses every form again, even those unchanged since the last run
+FORCE_REBUILD = False
+
 # %% [markdown]
 # ## Reading
 
@@ -84,12 +90,7 @@ for i in range(example_form.shape[0]):
 
 # %%
 def merge_nan_cols(df, col_regex):
-    selected_col_df = df.filter(regex=col_regex)
-    merged_col_series = selected_col_df.apply((
-        lambda x:
-            x.dropna()[-1]),
-        axis=1)
-    return merged_col_series
+    return coalesce_columns(df, col_regex)
 
 
 # %%
@@ -128,22 +129,10 @@ assert (fuvest_raw['Forma de ingresso'] == 'Fuvest').all()
 
 
 # %%
-def parse_fuvest_results(row):
-    return pd.Series({
-        'ano':                    row['Qual o seu ano de ingresso?'],
-        'modalidade':             row['Modalidade'],
-        'chamada':                row['Chamada'],
-        'nota_1':                 row['Nota na 1° fase'],
-        'nota_2_1':               row['Nota na 2° fase, 1° dia'],
-        'nota_2_2':               row['Nota na 2° fase, 2° dia'],
-        'nota_final':             row['Nota final'],
-        'nota_redacao':           row['Nota da redação'],
-        'classificacao_carreira': row['Classificação na carreira'],
-        'classificacao_curso':    row['Classificação no curso de ingresso'],
-        'redacao':                row['Envie aqui o espelho da sua redação'],
-    })
+def parse_fuvest_results(df):
+    return apply_schema(df, FormSchemas.FUVEST.value, errors='ignore')
 
-fuvest_data = fuvest_raw.apply(parse_fuvest_results, axis=1)
+fuvest_data = parse_fuvest_results(fuvest_raw)
 fuvest_data.head()
 
 # %%
@@ -160,26 +149,10 @@ assert (enem_raw['Forma de ingresso'] == 'SiSU (Enem)').all()
 
 
 # %%
-def parse_enem_results(row):
-    return pd.Series({
-        'ano':             row['Qual o seu ano de ingresso?'],
-        'modalidade':      row['Modalidade'],
-        'chamada':         row['Chamada'],
-        'nota_linguagens': row['Linguagens'],
-        'nota_humanas':    row['Ciências Humanas'],
-        'nota_natureza':   row['Ciências da Natureza'],
-        'nota_matematica': row['Matemática'],
-        'nota_redacao':    row['Redação'],
-        'nota_final':      row['Nota final.1'],
-        'nota_redacao_c1': row['Nota na Competência 1'],
-        'nota_redacao_c2': row['Nota na Competência 2'],
-        'nota_redacao_c3': row['Nota na Competência 3'],
-        'nota_redacao_c4': row['Nota na Competência 4'],
-        'nota_redacao_c5': row['Nota na Competência 5'],
-        'redacao':         row['Envie aqui o espelho da sua redação.1'],
-    })
-
-enem_data = enem_raw.apply(parse_enem_results, axis=1)
+def parse_enem_results(df):
+    return apply_schema(df, FormSchemas.ENEM.value, errors='ignore')
+
+enem_data = parse_enem_results(enem_raw)
 enem_data.head()
 
 # %%
@@ -193,55 +166,26 @@ np.nonzero(list(enem_results.ano.isna()))
 # %% [markdown]
 # ## Merging all collected data
 
-# %%
-def parse_exam_results(row, exam_name=''):
-    lower_exam_name = exam_name.lower()
-    if 'enem' in lower_exam_name:
-        return parse_enem_results(row)
-    elif 'fuvest' in lower_exam_name:
-        return parse_fuvest_results(row)
-    else:
-        raise ValueError(f'Unknown exam {exam_name}')
-
+# %% [markdown]
+# Each yearly form is independent, so `parse_forms` spreads the forms
+# across `FormsConfig.WORKERS` processes. Forms left
+# unchanged since the last run, according to the manifest in
+# `2_intermediate/forms`, are skipped. Setting `FormsConfig.CHUNKSIZE` streams
+# large forms in fixed-size chunks instead of loading them whole.
 
 # %%
-def parse_forms(data_directories: DataDirectories,
-                exams: Exams) -> None:
-    input_dir = data_directories.ONE.value / 'forms'
-    for form_path in input_dir.iterdir():
-        form_df = pd.read_csv(form_path)
+def main():
+    return parse_forms(DataDirectories, Exams,
+                       workers=FormsConfig.WORKERS.value,
+                       force=FORCE_REBUILD,
+                       chunksize=FormsConfig.CHUNKSIZE.value)
 
-        unidade_series = merge_nan_cols(form_df,
-            r'^Unidade|unidade \(')
-        curso_series = merge_nan_cols(form_df,
-            r'Curso')
-
-        id_regex = r'\((\d+)\)'
-        id_series = curso_series.str.extract(
-            id_regex, expand=False)
-        curso_series = curso_series.str.replace(
-            id_regex, '', regex=True).str.strip()
-
-        unidade_curso_df = pd.DataFrame({
-            'id': id_series,
-            'unidade': unidade_series,
-            'curso': curso_series,
-        })
-
-        for exam in exams:
-            exam_mask = form_df['Forma de ingresso'].str.contains(exam.value)
-            exam_raw = form_df[exam_mask]
-
-            exam_data = exam_raw.apply(parse_exam_results,
-                                       exam_name=exam.value,
-                                       axis=1)
-            exam_results = pd.concat([unidade_curso_df[exam_mask], exam_data],
-                                      axis=1)
-
-            output_dir = data_directories.TWO.value / 'forms' / exam.name.lower()
-            output_path = output_dir / (form_path.stem + '.csv')
-            exam_results.convert_dtypes().to_csv(output_path, index=False)
 
+# %% [markdown]
+# Worker processes started with the spawn or forkserver methods import the
+# main module again, so the forms are only parsed here when this notebook
+# runs as the main module. `mdv.scripts.initial` calls `main` itself.
 
 # %%
-parse_forms(DataDirectories, Exams)
+if __name__ == '__main__':
+    main()
@@ -29,14 +29,15 @@ fix_path()
 
 # %%
 from pathlib import Path
-from time import time_ns
 import os
 
-from PIL import Image
 import pandas as pd
 import numpy as np
 
 from mdv.config import DataDirectories, EssaysConfig, Exams
+from mdv.dedup import find_duplicates, move_duplicates, read_reviewed_pairs
+from mdv.essays import compare_encodings, cropped_bytes, parse_essay_forms, process_essays
+from mdv.storage import read_table
 
 # %% [markdown]
 # ### Parameters
@@ -47,13 +48,19 @@ ENEM_ESSAYS_DIR = (DataDirectories.ONE.value / 'redacoes'
 FUVEST_ESSAYS_DIR = (DataDirectories.ONE.value / 'redacoes'
                     / Exams.FUVEST.name.lower() / EssaysConfig.YEAR.value)
 ENEM_FORM_PATH = (DataDirectories.TWO.value / 'forms'
-                / Exams.ENEM.name.lower() / (EssaysConfig.YEAR.value+'.csv'))
+                / Exams.ENEM.name.lower() / EssaysConfig.YEAR.value)
 FUVEST_FORM_PATH = (DataDirectories.TWO.value / 'forms'
-                / Exams.FUVEST.name.lower() / (EssaysConfig.YEAR.value+'.csv'))
+                / Exams.FUVEST.name.lower() / EssaysConfig.YEAR.value)
 
 # %%
 OUTPUT_DIR = DataDirectories.TWO.value / 'redacoes'
 
+# %%
+# Detect where the form header ends instead of relying only on the aspect
+# ratio, see mdv.essays.detect_headers. Header ends far from the expected
+# one fall back to the aspect ratio check
+DETECT_HEADERS = True
+
 
 # %% [markdown]
 # ## Helper functions
@@ -75,131 +82,133 @@ def get_essays(form_df: pd.DataFrame,
 
 
 # %% [markdown]
-# ## Enem
-
-# %% [markdown]
-# ### Reading
-
-# %%
-enem_form_df = pd.read_csv(ENEM_FORM_PATH)
-enem_form_df.head()
+# ## Reading
+#
+# The essays of each exam are the answers of its form with an essay, in the
+# order of the scans in `ENEM_ESSAYS_DIR` and `FUVEST_ESSAYS_DIR`.
 
 # %%
-enem_images = listdir_sorted(ENEM_ESSAYS_DIR)
-print(len(enem_images))
-enem_images[:5]
-
-# %%
-enem_essays = get_essays(enem_form_df)
-print(enem_essays.shape)
-enem_essays
+def read_essays(form_path: Path, essays_dir: Path, exam: Exams) -> pd.DataFrame:
+    form_df = read_table(form_path)
+    essays_df = parse_essay_forms(get_essays(form_df), exam.name)
+    essays_df['filepath'] = listdir_sorted(essays_dir)
+    print(f'{exam.name.lower()}: {len(essays_df)} essays')
+    return essays_df
 
 
 # %% [markdown]
-# ### Parsing
-
-# %%
-def parse_enem_essays(row):
-    return pd.Series({
-        'ano':  row['ano'],
-        'nota': row['nota_redacao'],
-        'c1':   row['nota_redacao_c1'],
-        'c2':   row['nota_redacao_c2'],
-        'c3':   row['nota_redacao_c3'],
-        'c4':   row['nota_redacao_c4'],
-        'c5':   row['nota_redacao_c5'],
-    })
-
-enem_essays_processed = enem_essays.apply(parse_enem_essays,
-                                          axis=1)\
-                                   .convert_dtypes()
-enem_essays_processed['filepath'] = enem_images
-enem_essays_processed
+# ## Processing
 
 # %% [markdown]
-# ## Fuvest
+# Each scan is decoded, cropped and encoded independently, so the work is
+# spread across `EssaysConfig.WORKERS` processes. Output names are derived
+# from the essay information and a hash of the scan and settings, so scans
+# processed by a previous run are skipped, and outputs written with earlier
+# settings are deleted once a scan is processed again. With
+# `DETECT_HEADERS`, the header end of each new scan is first found on
+# greyscale thumbnails, in batches, so scans with an unexpected aspect ratio
+# are still cropped instead of going to revision.
+#
+# `EssaysConfig.MAX_SIZE` and `EssaysConfig.MEMORY_BUDGET` cap the memory
+# of each worker: large scans are reduced while decoding, and scans that
+# cannot be decoded within the budget go to revision. Set them to `None` to
+# keep every scan at its original resolution.
+
+# %%
+def process_exam_essays(essays_df: pd.DataFrame, exam_name: str) -> None:
+    exam_output_dir = OUTPUT_DIR / exam_name / EssaysConfig.YEAR.value
+    exam_results = process_essays(essays_df, exam_name, exam_output_dir,
+                                  workers=EssaysConfig.WORKERS.value,
+                                  detect=DETECT_HEADERS)
+    revision_count = sum(result.needs_revision for result in exam_results)
+    skipped_count = sum(result.skipped for result in exam_results)
+    print(f'{exam_name}: {len(exam_results)} essays, {revision_count} need revision, '
+          f'{skipped_count} already processed')
+
+    # Every cropped output of the exam counts, whether written by this run or
+    # an earlier one, including those moved to the duplicate directory
+    cropped_count = len(exam_results) - revision_count
+    scan_bytes, output_bytes = cropped_bytes(exam_results)
+    saved_ratio = 1 - output_bytes / scan_bytes if scan_bytes else 0
+    print(f'{exam_name}: {scan_bytes - output_bytes} bytes saved ({saved_ratio:.1%}) '
+          f'by the {cropped_count} cropped outputs in {EssaysConfig.ENCODING.value} '
+          f'over their scans')
+
 
 # %% [markdown]
-# ### Reading
+# ### Encodings
+#
+# Sizes of a sample of cropped essays in each encoding, used to pick
+# `EssaysConfig.ENCODING` and `EssaysConfig.QUALITY`.
 
 # %%
-fuvest_form_df = pd.read_csv(FUVEST_FORM_PATH)
-fuvest_form_df.head()
+ENCODING_SAMPLE_SIZE = 20
 
-# %%
-fuvest_images = listdir_sorted(FUVEST_ESSAYS_DIR)
-print(len(fuvest_images))
-fuvest_images[:5]
 
-# %%
-fuvest_essays = get_essays(fuvest_form_df)
-print(fuvest_essays.shape)
-fuvest_essays
+def print_encoding_sizes(essays_df: pd.DataFrame, exam_name: str) -> None:
+    sample_paths = essays_df.filepath[:ENCODING_SAMPLE_SIZE]
+    print(exam_name)
+    print(compare_encodings(sample_paths, exam_name))
 
 
 # %% [markdown]
-# ### Parsing
+# ## Deduplication
+#
+# Students sometimes send the same essay twice, or the same scan in
+# consecutive years. Essays whose perceptual hashes are within
+# `EssaysConfig.DEDUP['max_distance']` bits of an essay of a previous year, or
+# of an earlier essay of this year, are moved from `pronto` to
+# `EssaysConfig.DUPLICATE_DIR`, so they are not uploaded. Review that
+# directory and move back any essay wrongly taken as a duplicate. Moved
+# essays are recorded with the essay kept in their place in a ledger next
+# to the directory, so essays moved back are not moved again.
+
+# %%
+def deduplicate_essays(exam_name: str) -> None:
+    year_dirs = sorted((OUTPUT_DIR / exam_name).iterdir())
+    year_dir = OUTPUT_DIR / exam_name / EssaysConfig.YEAR.value
+    reference_paths = [
+        path
+        for previous_year_dir in year_dirs
+        if previous_year_dir.name < EssaysConfig.YEAR.value
+        and (previous_year_dir / EssaysConfig.NO_REVISION_DIR.value).exists()
+        for path in sorted((previous_year_dir / EssaysConfig.NO_REVISION_DIR.value).iterdir())
+    ]
+    image_paths = sorted((year_dir / EssaysConfig.NO_REVISION_DIR.value).iterdir())
+    duplicate_dir = year_dir / EssaysConfig.DUPLICATE_DIR.value
+    duplicates_df = find_duplicates(image_paths, reference_paths,
+                                    reviewed_pairs=read_reviewed_pairs(duplicate_dir))
+    moved_paths = move_duplicates(duplicates_df, duplicate_dir)
+    print(f'{exam_name}: {len(moved_paths)} duplicates of {len(duplicates_df)} essays')
+    print(duplicates_df.loc[duplicates_df.is_duplicate, ['path', 'cluster']])
 
-# %%
-def parse_fuvest_essays(row):
-    return pd.Series({
-        'ano':  row['ano'],
-        'nota': row['nota_redacao'],
-    })
-
-fuvest_essays_processed = fuvest_essays.apply(parse_fuvest_essays,
-                                            axis=1)\
-                                       .convert_dtypes()
-fuvest_essays_processed['filepath'] = fuvest_images
-fuvest_essays_processed
-
-# %%
-print(fuvest_essays_processed.iloc[-1].filepath)
-fuvest_essays_processed.iloc[-1]
 
 # %% [markdown]
-# ## Processing
+# ## Running
 
 # %%
-essays: dict[str, pd.DataFrame] = {
-    Exams.ENEM.name.lower(): enem_essays_processed,
-    Exams.FUVEST.name.lower(): fuvest_essays_processed
-}
-essays
+def main():
+    essays: dict[str, pd.DataFrame] = {
+        Exams.ENEM.name.lower(): read_essays(ENEM_FORM_PATH, ENEM_ESSAYS_DIR,
+                                             Exams.ENEM),
+        Exams.FUVEST.name.lower(): read_essays(FUVEST_FORM_PATH, FUVEST_ESSAYS_DIR,
+                                               Exams.FUVEST),
+    }
+    for exam_name, essays_df in essays.items():
+        process_exam_essays(essays_df, exam_name)
+    for exam_name, essays_df in essays.items():
+        print_encoding_sizes(essays_df, exam_name)
+    for exam_name in essays:
+        deduplicate_essays(exam_name)
+    return essays
 
-# %%
-for exam in Exams:
-    exam_name = exam.name.lower()
 
-    exam_output_dir = OUTPUT_DIR / exam_name / EssaysConfig.YEAR.value
-    exam_revision_dir = exam_output_dir / EssaysConfig.REVISION_DIR.value
-    exam_no_revision_dir = exam_output_dir / EssaysConfig.NO_REVISION_DIR.value
-    exam_revision_dir.mkdir(parents=True, exist_ok=True)
-    exam_no_revision_dir.mkdir(parents=True, exist_ok=True)
-
-    exam_df = essays[exam_name]
-    exam_images = exam_df.filepath
-    expected_ratio = EssaysConfig.ASPECT_RATIO.value[exam_name]
-    threshold = EssaysConfig.THRESHOLD.value[exam_name]
-    normalized_crop_height = EssaysConfig.NORMALIZED_CROP_HEIGHT.value[exam_name]
-
-    for _, row in exam_df.iterrows():
-        image_path = row.filepath
-        essay_data = row.drop('filepath')
-        with Image.open(image_path).convert('RGB') as image:
-            image_np = np.array(image)
-            aspect_ratio = float(image.width)/float(image.height)
-
-            if abs(aspect_ratio-expected_ratio) < threshold :
-                crop_height = int(normalized_crop_height * image.height)
-                image_no_header = image_np[crop_height:,:]
-                new_image = Image.fromarray(image_no_header)
-                image_dir = exam_no_revision_dir
-            else:
-                new_image = image
-                image_dir = exam_revision_dir
-
-            essay_information_str = list(map(str, essay_data))
-            image_filename = '-'.join(essay_information_str) + '_' + str(time_ns())
-            image_path = image_dir / (image_filename+'.png')
-            new_image.save(image_path)
+# %% [markdown]
+# Worker processes started with the spawn or forkserver methods import the
+# main module again, so the essays are only read, processed and
+# deduplicated here when this notebook runs as the main module.
+# `mdv.scripts.initial` may call `main` itself.
+
+# %%
+if __name__ == '__main__':
+    essays = main()
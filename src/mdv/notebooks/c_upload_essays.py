@@ -36,15 +36,10 @@ from PIL import Image
 import pandas as pd
 import numpy as np
 
-from mdv.config import DataDirectories, EssaysConfig, Exams
-
-# %%
-from io import BytesIO
-
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
-from googleapiclient.http import MediaIoBaseUpload
+from mdv.config import DataDirectories, DriveConfig, EssaysConfig, Exams, StorageConfig
+from mdv.drive import DriveUploader, UploadFailure, UploadLedger, upload_new_files
+from mdv.essays import ENCODINGS
+from mdv.storage import write_table
 
 # %% [markdown]
 # ### Parameters
@@ -53,37 +48,14 @@ from googleapiclient.http import MediaIoBaseUpload
 INPUT_DIR = DataDirectories.TWO.value / 'redacoes'
 OUTPUT_DIR = DataDirectories.THREE.value / 'redacoes'
 
+# MIME type of the outputs of stage b by lower case suffix, and of the scans
+# sent to revision, which keep their original suffix
+ESSAY_MIMETYPES = {**dict(ENCODINGS.values()), '.jpeg': 'image/jpeg'}
+
 
 # %% [markdown]
 # ## Helper functions
 
-# %%
-def upload_share_png_bytes(filename, bytes_):
-    SCOPES = ['https://www.googleapis.com/auth/drive']
-    SERVICE_ACCOUNT_FILE = 'service.json'
-    credentials = service_account.Credentials.from_service_account_file(
-        SERVICE_ACCOUNT_FILE, scopes=SCOPES)
-
-    try:
-        service = build('drive', 'v3', credentials=credentials)
-        file_metadata = {'name': filename}
-        media = MediaIoBaseUpload(bytes_, mimetype='image/png')
-        file = service.files().create(body=file_metadata,
-                                      media_body=media,
-                                      fields='id').execute()
-
-        permissions = {'type': 'anyone', 'role': 'reader'}
-        service.permissions().create(
-            fileId=file['id'],
-            body=permissions).execute()
-
-        return file['id']
-
-    except HttpError as error:
-        # TODO(developer) - Handle errors from drive API.
-        print(f'An error occurred: {error}')
-
-
 # %%
 def update_essay_information_dict(exam: str, information: list[str]) -> dict[str, str]:
     if not 2 <= len(information) <= 7:
@@ -98,32 +70,77 @@ def update_essay_information_dict(exam: str, information: list[str]) -> dict[str
 
 
 # %%
-def upload_images(exam: str, image_dir: Path, base_view_url: str) -> pd.DataFrame:
+def upload_images(uploader: DriveUploader, exam: str, image_dir: Path,
+                  base_view_url: str) -> tuple[pd.DataFrame, list[UploadFailure]]:
+
+    image_paths = []
+    skipped = []
+    for path in sorted(image_dir.iterdir()):
+        if path.suffix.lower() in ESSAY_MIMETYPES:
+            image_paths.append(path)
+        else:
+            skipped.append(UploadFailure(
+                path, ValueError(f'Unsupported file type {path.suffix}')))
+    ledger = UploadLedger(image_dir.parent / DriveConfig.LEDGER_FILENAME.value)
+    report = upload_new_files(uploader, ledger, image_paths, ESSAY_MIMETYPES,
+                              workers=DriveConfig.WORKERS.value)
 
     essay_df_list = []
-    for image_path in image_dir.glob('*.png'):
-        print(image_path.stem)
+    for image_path in image_paths:
+        if image_path not in report.drive_ids:
+            continue
         essay_information = image_path.stem.split('_')[0].split('-')
         essay_information_dict = update_essay_information_dict(exam, essay_information)
-        with image_path.open('rb') as image_file:
-            drive_id = upload_share_png_bytes(image_path.name, image_file)
-
+        drive_id = report.drive_ids[image_path]
         essay_information_dict['drive_id'] = drive_id
         essay_information_dict['url'] = base_view_url.format(drive_id)
-        essay_df_list.append(pd.Series(essay_information_dict))
+        essay_df_list.append(essay_information_dict)
 
-    essay_df = pd.concat(essay_df_list, axis=1).T
-    return essay_df
+    essay_df = pd.DataFrame(essay_df_list)
+    return essay_df, skipped + report.failures
 
 
 # %%
-DRIVE_VIEW_BASE_URL = 'https://drive.google.com/file/d/{}/view'
+DRIVE_VIEW_BASE_URL = DriveConfig.VIEW_BASE_URL.value
+
+# %% [markdown]
+# A single uploader is shared by every upload, so the credentials and the
+# Drive client are built once. Essays are uploaded by `DriveConfig.WORKERS`
+# threads, requests failing with 429 or 5xx are retried with exponential
+# backoff and sharing permissions are sent in batches of
+# `DriveConfig.BATCH_SIZE` files. Essays that could still not be uploaded or
+# shared are listed in the failure report and left out of the tables, so the
+# next run can upload them.
+#
+# Uploaded essays are recorded by content hash in the
+# `DriveConfig.LEDGER_FILENAME` ledger of each exam, next to its `pronto`
+# directory. Only new or changed essays are uploaded, and a run that was
+# interrupted resumes where it stopped. The tables list every essay in
+# `pronto` that is on Drive, whichever run uploaded it.
+
+# %%
+with DriveUploader.from_service_account_file() as uploader:
+    exam_essay_dfs = {}
+    exam_failures = {}
+    for exam in Exams:
+        exam_name = exam.name.lower()
+        exam_input_dir = INPUT_DIR / exam_name / EssaysConfig.YEAR.value / EssaysConfig.NO_REVISION_DIR.value
+        print(exam_input_dir)
+        exam_essay_dfs[exam_name], exam_failures[exam_name] = upload_images(
+            uploader, exam_name, exam_input_dir, DRIVE_VIEW_BASE_URL)
+        print(f'{exam_name}: {len(exam_essay_dfs[exam_name])} essays uploaded, '
+              f'{len(exam_failures[exam_name])} failed')
+
+# %%
+failures_df = pd.DataFrame([
+    {'exam': exam_name, 'path': failure.path.name, 'error': str(failure.error)}
+    for exam_name, failures in exam_failures.items()
+    for failure in failures
+], columns=['exam', 'path', 'error'])
+failures_df
 
 # %%
-for exam in Exams:
-    exam_name = exam.name.lower()
-    exam_input_dir = INPUT_DIR / exam_name / EssaysConfig.YEAR.value / EssaysConfig.NO_REVISION_DIR.value
-    print(exam_input_dir)
-    exam_output_path = OUTPUT_DIR /  exam_name / (EssaysConfig.YEAR.value+'.csv')
-    exam_essay_df = upload_images(exam_name, exam_input_dir, DRIVE_VIEW_BASE_URL)
-    exam_essay_df.to_csv(exam_output_path, index=False)
+for exam_name, exam_essay_df in exam_essay_dfs.items():
+    exam_output_path = OUTPUT_DIR /  exam_name / EssaysConfig.YEAR.value
+    write_table(exam_essay_df.convert_dtypes(), exam_output_path,
+                StorageConfig.REVIEW_FORMAT.value)
@@ -23,11 +23,10 @@ fix_path()
 
 # %%
 import os
-import shutil
-
-import pandas as pd
 
 from mdv.config import DataDirectories
+from mdv.merge import merge_tables_incremental
+from mdv.storage import list_tables, read_table, write_table
 
 # %%
 were_files_manually_reviewed = True
@@ -45,41 +44,44 @@ VACANCIES_OUTPUT_PATH = DataDirectories.FOUR.value
 ESSAY_INPUT_PATH = DataDirectories.THREE.value / 'redacoes'
 ESSAY_OUTPUT_PATH = DataDirectories.FOUR.value / 'redacoes'
 
+# Rows read at a time from each table, None reads whole tables at once
+CHUNKSIZE = None
+# Merge every table again instead of only the ones that changed
+FORCE_REBUILD = False
+
+# %% [markdown]
+# Merged tables are only rewritten when one of their input tables changed,
+# and then only the changed tables are read again, see
+# `mdv.merge.merge_tables_incremental`. Set `FORCE_REBUILD` to merge
+# everything again.
+
 # %% [markdown]
 # ## Forms
 
 # %%
 for exam in os.listdir(FORM_INPUT_PATH):
-    exam_forms_list = []
     exam_dir = os.path.join(FORM_INPUT_PATH, exam)
     if os.path.isdir(exam_dir):
-        for form in os.listdir(exam_dir):
-            form_path = os.path.join(exam_dir, form)
-            form_df = pd.read_csv(form_path)
-            exam_forms_list.append(form_df)
-        exam_forms_df = pd.concat(exam_forms_list)
-        exam_forms_df.to_csv(os.path.join(FORM_OUTPUT_PATH, exam + '.csv'), index=False)
+        merge_tables_incremental(list_tables(exam_dir),
+                                 FORM_OUTPUT_PATH / exam,
+                                 chunksize=CHUNKSIZE,
+                                 force=FORCE_REBUILD)
 
 # %% [markdown]
 # ## Vacancies
 
 # %%
-latest_vacancies_filename = sorted(os.listdir(VACANCIES_INPUT_PATH))[-1]
-latest_vacancies_path = os.path.join(VACANCIES_INPUT_PATH, latest_vacancies_filename)
-output_vacancies_filename = os.path.join(VACANCIES_OUTPUT_PATH, 'vagas.csv')
-shutil.copy(latest_vacancies_path, output_vacancies_filename)
+latest_vacancies_path = list_tables(VACANCIES_INPUT_PATH)[-1]
+write_table(read_table(latest_vacancies_path), VACANCIES_OUTPUT_PATH / 'vagas')
 
 # %% [markdown]
 # ## Essays
 
 # %%
 for exam in os.listdir(ESSAY_INPUT_PATH):
-    exam_essays_list = []
     exam_dir = os.path.join(ESSAY_INPUT_PATH, exam)
     if os.path.isdir(exam_dir):
-        for essays in os.listdir(exam_dir):
-            essays_path = os.path.join(exam_dir, essays)
-            essays_df = pd.read_csv(essays_path)
-            exam_essays_list.append(essays_df)
-        exam_essays_df = pd.concat(exam_essays_list)
-        exam_essays_df.to_csv(os.path.join(ESSAY_OUTPUT_PATH, exam + '.csv'), index=False)
+        merge_tables_incremental(list_tables(exam_dir),
+                                 ESSAY_OUTPUT_PATH / exam,
+                                 chunksize=CHUNKSIZE,
+                                 force=FORCE_REBUILD)
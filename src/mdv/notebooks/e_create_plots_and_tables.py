@@ -23,26 +23,56 @@ fix_path()
 # %% id="DuZ9D3RvZtJo"
 import os
 
-import plotly
 import plotly.express as px
-import plotly.graph_objects as go
-import pandas as pd
 
-from mdv.config import DataDirectories
+from mdv.config import DataDirectories, PlotsConfig
+from mdv.manifest import Manifest
+from mdv.metrics import compute_metrics, latest_metrics, select_metrics
+from mdv.plots import (
+  MANIFEST_FILENAME,
+  METRIC_COLUMNS,
+  MetricEvolutionFactory,
+  clear_content,
+  content_version,
+  latest_metrics_table,
+  partition_data_tables,
+  partition_data_tables_by_course,
+  plan_content,
+  record_content,
+  run_by_course,
+  table_from_df,
+  write_data_tables,
+  write_latest_metrics_table,
+  write_metric_evolution,
+)
+from mdv.storage import read_table, write_table
 
 # %% id="QSI1tOa2Z-4A"
 INPUT_PATH = DataDirectories.FOUR.value / 'forms'
 OUTPUT_PATH = DataDirectories.FIVE.value
+# Metrics of every course, year and quota, see mdv.metrics.compute_metrics
+METRICS_PATH = DataDirectories.FOUR.value / 'metrics'
+# Processes writing the figures and tables, each one handling whole courses
+WORKERS = PlotsConfig.WORKERS.value
+# 'plotly' or 'html' for static tables, see mdv.plots.write_table
+LATEST_METRICS_TABLE_BACKEND = PlotsConfig.TABLE_BACKENDS.value['latest_metrics']
+DATA_TABLE_BACKEND = PlotsConfig.TABLE_BACKENDS.value['data']
+# 'fragment' or 'page' for figure specs plotted once per page by stage f,
+# see mdv.plots.plotly_fig_to_html
+FIGURE_MODE = PlotsConfig.FIGURE_MODE.value
+# Only the courses whose rows or settings changed since the last run are
+# written again, unless FORCE_REBUILD is set
+FORCE_REBUILD = False
 
 # %% [markdown] id="HUixgzJbeG4y"
 # ## Reading
 
 # %% colab={"base_uri": "https://localhost:8080/", "height": 478} id="Ul6nEbWvZ0k7" outputId="04f7baa7-3b32-4593-948f-0b4d3cff9eb8"
-enem = pd.read_csv(os.path.join(INPUT_PATH, 'enem.csv')).convert_dtypes()
+enem = read_table(INPUT_PATH / 'enem')
 enem.head()
 
 # %% colab={"base_uri": "https://localhost:8080/", "height": 392} id="GVyPBuqhaQfh" outputId="d060c8ee-af15-48c8-860b-192c8e7aca47"
-fuvest = pd.read_csv(os.path.join(INPUT_PATH, 'fuvest.csv')).convert_dtypes()
+fuvest = read_table(INPUT_PATH / 'fuvest')
 fuvest.head()
 
 
@@ -52,69 +82,85 @@ fuvest.head()
 # %% [markdown] id="SRDEfmRDxKXR"
 # ### Support functions
 
-# %% id="yjSGGgkKxMMS"
-def table_from_df(df, cols=None, manual_header=None, cells_format=None):
-  if cols is None:
-    cols = df.columns
-
-  if manual_header is not None:
-    header_values = manual_header
-  else:
-    header_values = cols
-
-  data_list = [df[col] for col in cols]
-  fig = go.Figure(data=go.Table(
-      header=dict(values=header_values,
-                  align='center'),
-      cells=dict(values=data_list,
-                 format=cells_format),
-  ))
-  return fig
-
-
-# %% id="6knHEEmKR7GF"
-def plotly_fig_to_html(fig, path):
-  fig.update_layout(margin=dict(
-      b=0,
-      l=0,
-      r=0,
-      t=0,
-  ))
-  fig.write_html(path, include_plotlyjs='cdn', full_html=False)
+# %% [markdown]
+# ### Incremental content
+#
+# The content of each course is fingerprinted with its rows and the
+# settings below. Courses whose fingerprint matches the manifest in
+# `OUTPUT_PATH` keep their content, the others are written again, and the
+# content of courses without rows is deleted.
+
+# %%
+CONTENT_MANIFEST = Manifest(OUTPUT_PATH / MANIFEST_FILENAME, content_version())
+
+
+def content_settings(cols, header, cells_format):
+  return (cols, header, cells_format,
+          LATEST_METRICS_TABLE_BACKEND, DATA_TABLE_BACKEND, FIGURE_MODE)
+
 
+def prepare_content(exam_df, exam, settings):
+  plan = plan_content(CONTENT_MANIFEST, exam_df, exam, OUTPUT_PATH, settings,
+                      force=FORCE_REBUILD)
+  print(f'{exam}: writing {len(plan.changed)} of {len(plan.fingerprints)} courses, '
+        f'removing {len(plan.removed)}')
+  clear_content(OUTPUT_PATH, exam, plan.changed + plan.removed)
+  changed_df = exam_df.loc[exam_df.id.astype(str).isin(plan.changed)]
+  for id, ano in changed_df[['id', 'ano']].drop_duplicates().itertuples(index=False):
+    os.makedirs(os.path.join(OUTPUT_PATH, str(id), exam, str(ano)), exist_ok=True)
+  return plan
+
+
+def finish_content(exam, plan):
+  record_content(CONTENT_MANIFEST, exam, OUTPUT_PATH, plan)
+  CONTENT_MANIFEST.save()
+
+
+# %% [markdown] id="yjSGGgkKxMMS"
+# The figures and tables are built by `mdv.plots`, so that they can be
+# written by a pool of processes. `run_by_course` sends each process only
+# the slices of the data of its courses, and the data shared by every
+# course, such as the figure factory, once.
 
 # %% [markdown] id="5u1YDsnweQE5"
 # ### Fuvest
 
-# %% id="AhTt3k_hNeo9"
-for index, row in fuvest[['id', 'ano']].drop_duplicates().iterrows():
-  os.makedirs(os.path.join(OUTPUT_PATH, str(row.id), 'fuvest', str(row.ano)))
+# %%
+TABLE_COL_NAMES = [
+  'chamada',
+  'nota_1',
+  'nota_2_1',
+  'nota_2_2',
+  'nota_final',
+  'nota_redacao',
+  'classificacao_carreira',
+  'classificacao_curso',
+]
+HEADER_COL_NAMES = [
+  'Chamada',
+  '1° fase',
+  '2° fase, 1° dia',
+  '2° fase, 2° dia',
+  'Nota final',
+  'Nota da redação',
+  'Classificação na carreira',
+  'Classificação no curso',
+]
+COL_FORMATS = [None, None, '.2f', '.2f', '.2f', '.1f', None, None]
 
 # %% colab={"base_uri": "https://localhost:8080/"} id="atQcpoLOacP6" outputId="27197c86-dc23-4af5-e8f0-df165a564f41"
-fuvest_grouped = fuvest.groupby(['id', 'ano', 'modalidade'])
-fuvest_grouped.groups
-
-# %% colab={"base_uri": "https://localhost:8080/", "height": 455} id="laWfawLaawJh" outputId="181a0ede-20c7-466f-b4c0-d20441cee1e4"
-fuvest_metrics_df = fuvest_grouped.agg(
-  Mínimo=('nota_final', 'min'),
-  Máximo=('nota_final', 'max'),
-  Médio=('nota_final', 'mean'),
-)
+fuvest_metrics_df = compute_metrics(fuvest)
 fuvest_metrics_df
 
 # %% [markdown] id="Lar2h-t9Qg0-"
 # #### Metrics plot
 
 # %% colab={"base_uri": "https://localhost:8080/", "height": 238} id="kZC-Y8-k1z5O" outputId="cc3c0024-06b0-4bfe-d69d-0c3ddf77f92b"
-example_metrics = fuvest_metrics_df.loc[0].reset_index()
+example_metrics = fuvest_metrics_df.loc[fuvest_metrics_df.id == 0]
 example_metrics
 
 # %% colab={"base_uri": "https://localhost:8080/", "height": 614} id="WkVijELW_yh2" outputId="47bad51c-f8e1-4d72-ce68-fb119f02fe13"
-molten_example_metrics = pd.melt(example_metrics,
-                                 id_vars=['ano', 'modalidade'],
-                                 value_vars=['Mínimo', 'Médio', 'Máximo'],
-                                 var_name='metric',
-                                 value_name='nota')
+molten_example_metrics = select_metrics(example_metrics, METRIC_COLUMNS)
 molten_example_metrics
 
 # %% colab={"base_uri": "https://localhost:8080/"} id="YZIBwEDzt9Ox" outputId="64f84af0-6a00-40df-a817-dda41ee5a9e6"
@@ -144,57 +190,12 @@ px.line(
 
 
 # %% colab={"base_uri": "https://localhost:8080/", "height": 560} id="wOl0I3j4PqX-" outputId="f599b467-4c1e-4b70-d601-a4fc1aa82f66"
-def abbreviate_quota(plotly_annotation):
-  text = plotly_annotation.text
-  new_text = text
-  for abbreviation in ['AC', 'EP', 'PPI']:
-    if abbreviation in text:
-      new_text = abbreviation
-      break
-
-  return plotly_annotation.update(text=new_text)
-
+# The layout of the figures is built once for each set of quotas, see
+# MetricEvolutionFactory
+fuvest_figure_factory = MetricEvolutionFactory(fuvest_metrics_df)
 figs = []
 for id, df in fuvest_metrics_df.groupby('id'):
-  molten_df = pd.melt(df.reset_index(),
-                      id_vars=['ano', 'modalidade'],
-                      value_vars=['Mínimo', 'Máximo', 'Médio'],
-                      var_name='metric',
-                      value_name='nota')
-  fig = px.line(
-    molten_df,
-    x='ano', y='nota',
-    color='metric',
-    facet_row='modalidade',
-    markers=True,
-
-    labels={
-        'ano': 'Ano de ingresso',
-        'nota': '',
-        'metric': 'Valor',
-    },
-    category_orders={
-        'modalidade': ['Ampla Concorrência (AC)',
-                      'Escola Pública (EP)',
-                      'Pretos, Pardos e Indígenas (PPI)'],
-        'metric': ['Máximo', 'Médio', 'Mínimo'],
-    },
-  )
-  first_year = molten_df.ano.min()
-  fig.update_layout(
-      xaxis=dict(
-          tickmode='linear',
-          tick0=first_year,
-          dtick=1,
-          fixedrange=True,
-      ),
-      yaxis=dict(
-          fixedrange=True,
-      ),
-  )
-  fig.for_each_annotation(abbreviate_quota)
-
-  figs.append(fig)
+  figs.append(fuvest_figure_factory.figure(df))
 
 print(len(figs))
 figs[0].show()
@@ -204,83 +205,30 @@ figs[102].show()
 
 
 # %% id="Kh0YD9JdQVuB"
-def plot_metric_evolution(metrics_df, exam='fuvest'):
-
-  def abbreviate_quota(plotly_annotation):
-    text = plotly_annotation.text
-    new_text = text
-    for abbreviation in ['AC', 'EP', 'PPI']:
-      if abbreviation in text:
-        new_text = abbreviation
-        break
-
-    return plotly_annotation.update(text=new_text)
-
-  for id, df in metrics_df.groupby('id'):
-    molten_df = pd.melt(df.reset_index(),
-                        id_vars=['ano', 'modalidade'],
-                        value_vars=['Mínimo', 'Máximo', 'Médio'],
-                        var_name='metric',
-                        value_name='nota')
-    fig = px.line(
-      molten_df,
-      x='ano', y='nota',
-      color='metric',
-      facet_row='modalidade',
-      markers=True,
-
-      labels={
-          'ano': 'Ano de ingresso',
-          'nota': '',
-          'metric': 'Valor',
-      },
-      category_orders={
-          'modalidade': ['Ampla Concorrência (AC)',
-                        'Escola Pública (EP)',
-                        'Pretos, Pardos e Indígenas (PPI)'],
-          'metric': ['Máximo', 'Médio', 'Mínimo'],
-      },
-    )
-    first_year = molten_df.ano.min()
-    fig.update_layout(
-        xaxis=dict(
-            tickmode='linear',
-            tick0=first_year,
-            dtick=1,
-            fixedrange=True,
-        ),
-        yaxis=dict(
-            fixedrange=True,
-        ),
-    )
-    fig.for_each_annotation(abbreviate_quota)
-
-    plotly_fig_to_html(
-      fig,
-      os.path.join(OUTPUT_PATH, str(id), exam,
-                   'metric_evolution.html'))
-
-
-# %% id="HLiHOvQkRSnB"
-plot_metric_evolution(fuvest_metrics_df)
+def plot_metric_evolution(metrics_df, exam='fuvest', courses=None):
+  metrics_df = select_metrics(metrics_df, METRIC_COLUMNS)
+  factory = MetricEvolutionFactory(metrics_df)
+  run_by_course(write_metric_evolution,
+                [(id, df, exam, OUTPUT_PATH, FIGURE_MODE)
+                 for id, df in metrics_df.groupby('id')
+                 if courses is None or str(id) in courses],
+                WORKERS, shared_args=(factory,))
+
 
 # %% [markdown] id="EbdflwE3Qk5a"
 # #### Metrics table for the latest year
 
 # %% colab={"base_uri": "https://localhost:8080/"} id="wFBBtcTPp_vA" outputId="cbff5066-417a-4dcb-d1c9-8c902bbf3467"
-for id, df in fuvest_metrics_df.reset_index().groupby('id'):
+fuvest_latest_metrics_df = latest_metrics(fuvest_metrics_df)
+for id, df in fuvest_latest_metrics_df.groupby('id'):
   print(id)
   print(df[['ano', 'modalidade', 'Mínimo', 'Médio', 'Máximo']])
 
 # %% colab={"base_uri": "https://localhost:8080/", "height": 560} id="YrLvVeq_MN0X" outputId="77c4db96-a407-4a50-ba89-56edfb14dded"
 metric_tables = []
 # TODO add latest avaliable year to the title of the table
-for id, df in fuvest_metrics_df.reset_index().groupby('id'):
-  latest_metrics_df = df.loc[df.ano == df.ano.max()]
-  metric_tables.append(table_from_df(latest_metrics_df,
-                                     ['modalidade', 'Mínimo', 'Médio', 'Máximo'],
-                                     ['Modalidade', 'Mínima', 'Média', 'Máxima'],
-                                     [None, '.2f', '.2f', '.2f']))
+for id, df in fuvest_latest_metrics_df.groupby('id'):
+  metric_tables.append(latest_metrics_table(df))
 
 print(len(metric_tables))
 metric_tables[0].show()
@@ -290,125 +238,47 @@ metric_tables[45].show()
 
 
 # %% id="K3vIUQYTRkaA"
-def plot_latest_metrics_table(metrics_df, exam='fuvest'):
+def plot_latest_metrics_table(metrics_df, exam='fuvest', courses=None):
   # TODO add latest avaliable year to the title of the table
-  for id, df in metrics_df.reset_index().groupby('id'):
-    latest_metrics_df = df.loc[df.ano == df.ano.max()]
-    plotly_fig_to_html(
-      table_from_df(latest_metrics_df,
-                    ['modalidade', 'Mínimo', 'Médio', 'Máximo'],
-                    ['Modalidade', 'Mínima', 'Média', 'Máxima'],
-                    [None, '.2f', '.2f', '.2f']),
-      os.path.join(OUTPUT_PATH, str(id), exam,
-                   'latest_metrics.html'))
+  run_by_course(write_latest_metrics_table,
+                [(id, df, exam, OUTPUT_PATH, LATEST_METRICS_TABLE_BACKEND,
+                  FIGURE_MODE)
+                 for id, df in latest_metrics(metrics_df).groupby('id')
+                 if courses is None or str(id) in courses],
+                WORKERS)
 
 
-# %% id="ZsUpOV2fSk5B"
-plot_latest_metrics_table(fuvest_metrics_df)
-
 # %% [markdown] id="-BJxEYQjQqgt"
 # #### Data tables
 
 # %% colab={"base_uri": "https://localhost:8080/", "height": 560} id="oRsXXlnnBv4p" outputId="fb59ffd6-666b-4450-86c6-0a5cb42c8387"
-TABLE_COL_NAMES = [
-  'chamada',
-  'nota_1',
-  'nota_2_1',
-  'nota_2_2',
-  'nota_final',
-  'nota_redacao',
-  'classificacao_carreira',
-  'classificacao_curso',
-]
-HEADER_COL_NAMES = [
-  'Chamada',
-  '1° fase',
-  '2° fase, 1° dia',
-  '2° fase, 2° dia',
-  'Nota final',
-  'Nota da redação',
-  'Classificação na carreira',
-  'Classificação no curso',
-]
-COL_FORMATS = [None, None, '.2f', '.2f', '.2f', '.1f', None, None]
 data_tables = []
-
-for id, df in fuvest.groupby('id'):
-  df = df.reset_index()
-  for ano in df['ano'].unique():
-    for modalidade in df['modalidade'].unique():
-      sliced_df = df[(df['ano'] == ano)
-                     & (df['modalidade'] == modalidade)]
-      if not sliced_df.empty:
-        sliced_df = sliced_df.sort_values('nota_final', ascending=False)
-        full_df = sliced_df.astype(str)
-        data_tables.append(table_from_df(full_df,
-                                         TABLE_COL_NAMES,
-                                         HEADER_COL_NAMES,
-                                         COL_FORMATS))
+for (id, ano, modalidade), table_df in partition_data_tables(fuvest, TABLE_COL_NAMES):
+  data_tables.append(table_from_df(table_df,
+                                   TABLE_COL_NAMES,
+                                   HEADER_COL_NAMES,
+                                   COL_FORMATS))
 print(len(data_tables))
 data_tables[0].show()
 
 
 # %% id="R7BiT2I6Dl4A"
-def plot_data_tables(exam_df, cols, header, cells_format, exam='fuvest'):
-  for id, df in exam_df.groupby('id'):
-    df = df.reset_index()
-    for ano in df['ano'].unique():
-      for modalidade in df['modalidade'].unique():
-        sliced_df = df[(df['ano'] == ano)
-                      & (df['modalidade'] == modalidade)]
-        if not sliced_df.empty:
-          sliced_df = sliced_df.sort_values('nota_final', ascending=False)
-          full_df = sliced_df.astype(str)
-          plotly_fig_to_html(
-            table_from_df(full_df, cols, header, cells_format),
-            os.path.join(OUTPUT_PATH, str(id), exam,
-                         str(ano), f'{modalidade}.html')
-          )
-
-
-# %% id="2ClaiKpNUUPq"
-plot_data_tables(fuvest, TABLE_COL_NAMES, HEADER_COL_NAMES, COL_FORMATS)
+def plot_data_tables(exam_df, cols, header, cells_format, exam='fuvest',
+                     courses=None):
+  if courses is not None:
+    exam_df = exam_df.loc[exam_df.id.astype(str).isin(courses)]
+  # Grouped and sorted once, see partition_data_tables
+  run_by_course(write_data_tables,
+                [(id, course_tables, cols, header, cells_format, exam, OUTPUT_PATH,
+                  DATA_TABLE_BACKEND, FIGURE_MODE)
+                 for id, course_tables in partition_data_tables_by_course(exam_df, cols)],
+                WORKERS)
+
 
 # %% [markdown] id="XAGWr2lwH_3F"
 # ### Enem
 
-# %% id="exX5crdzH90O"
-for index, row in enem[['id', 'ano']].drop_duplicates().iterrows():
-  os.makedirs(os.path.join(OUTPUT_PATH, str(row.id), 'enem', str(row.ano)))
-
-# %% colab={"base_uri": "https://localhost:8080/"} id="zBoqmK_sIovD" outputId="923ceb25-2a83-4571-90ce-e2ce14c5597f"
-enem_grouped = enem.groupby(['id', 'ano', 'modalidade'])
-enem_grouped.groups
-
-# %% colab={"base_uri": "https://localhost:8080/", "height": 455} id="Sbvkr2H_IscW" outputId="cc895dbd-dac9-4253-8eff-03459605bc7b"
-enem_metrics_df = enem_grouped.agg(
-  Mínimo=('nota_final', 'min'),
-  Máximo=('nota_final', 'max'),
-  Médio=('nota_final', 'mean'),
-)
-enem_metrics_df
-
-# %% [markdown] id="c7nmj1wRJVWG"
-# #### Metrics plot
-
-# %% id="uvB19k5jJXMR"
-plot_metric_evolution(enem_metrics_df, exam='enem')
-
-# %% [markdown] id="-5Z8re_YJek_"
-# #### Metrics table for the latest year
-
-# %% id="A9__x452JiA6"
-plot_latest_metrics_table(enem_metrics_df, exam='enem')
-
-# %% [markdown] id="euOIApzyJy2c"
-# #### Data tables
-
-# %% colab={"base_uri": "https://localhost:8080/"} id="wAt6u6thKvFL" outputId="c22fcf39-9a47-49d3-aa91-1b240781a9ab"
-enem.columns
-
-# %% id="Pi9dzfvqJ1Po"
+# %%
 ENEM_TABLE_COL_NAMES = [
   'chamada',
   'nota_linguagens',
@@ -429,8 +299,45 @@ ENEM_HEADER_COL_NAMES = [
 ]
 ENEM_COL_FORMATS = [None, '.2f', '.2f', '.2f', '.2f', '.3d', '.2f']
 
-plot_data_tables(enem,
-                 ENEM_TABLE_COL_NAMES,
-                 ENEM_HEADER_COL_NAMES,
-                 ENEM_COL_FORMATS,
-                 exam='enem')
+# %% colab={"base_uri": "https://localhost:8080/"} id="zBoqmK_sIovD" outputId="923ceb25-2a83-4571-90ce-e2ce14c5597f"
+enem_metrics_df = compute_metrics(enem)
+enem_metrics_df
+
+# %% colab={"base_uri": "https://localhost:8080/"} id="wAt6u6thKvFL" outputId="c22fcf39-9a47-49d3-aa91-1b240781a9ab"
+enem.columns
+
+
+# %% [markdown]
+# ## Writing
+#
+# The metrics table of each exam is written to `METRICS_PATH`, and the
+# figures and tables of its changed courses to `OUTPUT_PATH`.
+
+# %%
+def write_exam_content(exam_df, exam, cols, header, cells_format):
+  plan = prepare_content(exam_df, exam, content_settings(cols, header, cells_format))
+  metrics_df = compute_metrics(exam_df)
+  METRICS_PATH.mkdir(parents=True, exist_ok=True)
+  write_table(metrics_df, METRICS_PATH / exam)
+
+  plot_metric_evolution(metrics_df, exam, courses=plan.changed)
+  plot_latest_metrics_table(metrics_df, exam, courses=plan.changed)
+  plot_data_tables(exam_df, cols, header, cells_format, exam, courses=plan.changed)
+  finish_content(exam, plan)
+
+
+def main():
+  write_exam_content(fuvest, 'fuvest',
+                     TABLE_COL_NAMES, HEADER_COL_NAMES, COL_FORMATS)
+  write_exam_content(enem, 'enem',
+                     ENEM_TABLE_COL_NAMES, ENEM_HEADER_COL_NAMES, ENEM_COL_FORMATS)
+
+
+# %% [markdown]
+# Worker processes started with the spawn or forkserver methods import the
+# main module again, so the content is only written here when this
+# notebook runs as the main module.
+
+# %%
+if __name__ == '__main__':
+  main()
@@ -32,17 +32,24 @@ from unidecode import unidecode
 from jinja2 import Environment, FileSystemLoader, select_autoescape
 import pandas as pd
 
-from mdv.config import DataDirectories, REPOSITORY_ROOT
+from mdv.config import DataDirectories, PlotsConfig, REPOSITORY_ROOT
+from mdv.plots import figure_page_assets
+from mdv.storage import read_table
 
 # %%
 TEMPLATES_DIR = REPOSITORY_ROOT / 'templates'
 CONTENT_DIR = DataDirectories.FIVE.value
 GRADES_RESULT_DIR = REPOSITORY_ROOT / 'website/notas'
 
-ID_TABLE_PATH = DataDirectories.FOUR.value / 'vagas.csv'
+ID_TABLE_PATH = DataDirectories.FOUR.value / 'vagas'
 ESSAYS_DIR = DataDirectories.FOUR.value / 'redacoes'
 ESSAYS_RESULT_DIR = REPOSITORY_ROOT / 'website/redacoes'
 
+# Same as in stage e. In 'page' mode every course page loads the Plotly
+# runtime and the layout template once for all its figures
+FIGURE_MODE = PlotsConfig.FIGURE_MODE.value
+FIGURE_PAGE_ASSETS = figure_page_assets() if FIGURE_MODE == 'page' else {}
+
 
 # %% [markdown]
 # ## Support functions
@@ -130,7 +137,7 @@ JINJA_ENV = Environment(
 # ### Grades
 
 # %%
-ID_DF = pd.read_csv(ID_TABLE_PATH).convert_dtypes()
+ID_DF = read_table(ID_TABLE_PATH)
 print(ID_DF.dtypes)
 ID_DF
 
@@ -231,7 +238,8 @@ def render_courses(content_dir, jinja_env, id_df, result_dir):
                         course_name=course_name,
                         latest_metrics_plotly_div=latest_metrics,
                         metric_evolution_plotly_div=metric_evolution,
-                        grade_dict=grade_dict)
+                        grade_dict=grade_dict,
+                        **FIGURE_PAGE_ASSETS)
                     fuvest_path = create_render_save_path(
                         result_dir=result_dir,
                         course_id=course_id,
@@ -249,7 +257,8 @@ def render_courses(content_dir, jinja_env, id_df, result_dir):
                         course_name=course_name,
                         latest_metrics_plotly_div=latest_metrics,
                         metric_evolution_plotly_div=metric_evolution,
-                        grade_dict=grade_dict)
+                        grade_dict=grade_dict,
+                        **FIGURE_PAGE_ASSETS)
                     enem_path = create_render_save_path(
                         result_dir=result_dir,
                         course_id=course_id,
@@ -294,11 +303,11 @@ def join_essay_files(exam, essays_dir):
 
 
 # %%
-enem_essays = pd.read_csv(join(ESSAYS_DIR, 'enem.csv')).convert_dtypes()
+enem_essays = read_table(ESSAYS_DIR / 'enem')
 enem_essays
 
 # %%
-fuvest_essays = pd.read_csv(join(ESSAYS_DIR, 'fuvest.csv')).convert_dtypes()
+fuvest_essays = read_table(ESSAYS_DIR / 'fuvest')
 fuvest_essays
 
 
@@ -362,7 +371,7 @@ def render_essays(jinja_env, essays_dir, result_dir,
                   essay_template_filename='redacoes.html.jinja',
                   selection_template_filename='vestibulares.html.jinja'):
     for exam in ['enem', 'fuvest']:
-        exam_essays = pd.read_csv(join(ESSAYS_DIR, exam + '.csv')).convert_dtypes()
+        exam_essays = read_table(ESSAYS_DIR / exam)
         years_dict = build_years_dict(exam_essays)
         criteria = None
         if exam == 'enem':
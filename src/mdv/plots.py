@@ -0,0 +1,572 @@
+from concurrent.futures import ProcessPoolExecutor
+from copy import deepcopy
+from itertools import groupby, repeat
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, NamedTuple, Sequence
+import base64
+import hashlib
+import html
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+from plotly.io.json import to_json_plotly
+from plotly.offline import get_plotlyjs, get_plotlyjs_version
+import plotly
+import plotly.express as px
+import plotly.graph_objects as go
+import plotly.io as pio
+
+from mdv.manifest import Manifest
+from mdv.metrics import select_metrics
+
+# Bump whenever the figures or tables change so every course is written again
+PLOTS_VERSION = 1
+MANIFEST_FILENAME = 'manifest.json'
+
+PARTITION_COLUMNS = ['id', 'ano', 'modalidade']
+SORT_COLUMN = 'nota_final'
+QUOTA_ABBREVIATIONS = ['AC', 'EP', 'PPI']
+METRIC_COLUMNS = ['Mínimo', 'Máximo', 'Médio']
+QUOTA_ORDER = ['Ampla Concorrência (AC)',
+               'Escola Pública (EP)',
+               'Pretos, Pardos e Indígenas (PPI)']
+FIGURE_MARGIN = dict(
+    b=0,
+    l=0,
+    r=0,
+    t=0,
+)
+LATEST_METRICS_COLUMNS = ['modalidade', 'Mínimo', 'Médio', 'Máximo']
+LATEST_METRICS_HEADER = ['Modalidade', 'Mínima', 'Média', 'Máxima']
+LATEST_METRICS_FORMATS = [None, '.2f', '.2f', '.2f']
+TABLE_BACKENDS = ('plotly', 'html')
+HTML_TABLE_CLASS = 'table table-striped table-hover table-sm text-center'
+FIGURE_MODES = ('fragment', 'page')
+FIGURE_SPEC_CLASS = 'figure-spec'
+# From plotly 6, Figure.to_dict encodes numeric arrays as plotly.js typed
+# arrays of these dtypes, which plotly.js decodes from 2.28 on
+ENCODES_TYPED_ARRAYS = int(plotly.__version__.split('.')[0]) >= 6
+TYPED_ARRAY_DTYPES = {
+    'int8'   : 'i1',
+    'uint8'  : 'u1',
+    'int16'  : 'i2',
+    'uint16' : 'u2',
+    'int32'  : 'i4',
+    'uint32' : 'u4',
+    'float32': 'f4',
+    'float64': 'f8',
+}
+
+
+class ContentPlan(NamedTuple):
+    fingerprints    : dict[str, str]
+    changed         : list[str]
+    removed         : list[str]
+
+
+def content_version() -> str:
+    """Identifies the figure and table code and the Plotly version."""
+    return f'{PLOTS_VERSION}-{plotly.__version__}'
+
+
+def course_fingerprints(exam_df: pd.DataFrame, settings) -> dict[str, str]:
+    """Hashes the rows of each course of exam_df together with settings,
+    e.g. the columns, headers and formats of its tables.
+
+    The rows of each course are hashed in their order in exam_df, which
+    decides the order of tied rows in the data tables.
+    """
+    exam_df = exam_df.dropna(subset=['id'])
+    settings_digest = hashlib.sha256(
+        repr((list(exam_df.columns), settings)).encode('utf8')).digest()
+    row_hashes = pd.util.hash_pandas_object(exam_df, index=False).to_numpy()
+    ids = exam_df['id'].to_numpy()
+    order = np.argsort(ids, kind='stable')
+    sorted_ids = ids[order]
+    starts = np.flatnonzero(np.r_[True, sorted_ids[1:] != sorted_ids[:-1]])
+    ends = np.r_[starts[1:], len(order)]
+
+    fingerprints = {}
+    for start, end in zip(starts, ends):
+        digest = hashlib.sha256(settings_digest)
+        digest.update(row_hashes[order[start:end]].tobytes())
+        fingerprints[str(sorted_ids[start])] = digest.hexdigest()
+    return fingerprints
+
+
+def plan_content(manifest: Manifest, exam_df: pd.DataFrame, exam: str,
+                 output_path: Path, settings, force: bool = False) -> ContentPlan:
+    """Finds the courses of exam whose content must be written again.
+
+    A course changed when its fingerprint (see course_fingerprints) or its
+    outputs differ from the manifest, or with force. Courses with content
+    on disk or in the manifest but no rows in exam_df are removed.
+    """
+    fingerprints = course_fingerprints(exam_df, settings)
+    changed = [id for id, fingerprint in fingerprints.items()
+               if force or not manifest.is_up_to_date(f'{exam}/{id}', fingerprint)]
+    previous_ids = {key.split('/', 1)[1] for key in manifest.entries
+                    if key.startswith(f'{exam}/')}
+    written_ids = {path.parent.name for path in Path(output_path).glob(f'*/{exam}')}
+    removed = sorted((previous_ids | written_ids) - set(fingerprints))
+    return ContentPlan(fingerprints, changed, removed)
+
+
+def clear_content(output_path: Path, exam: str, ids: Iterable[str]) -> None:
+    """Deletes the content of exam of each course in ids, and the course
+    directory once it is empty."""
+    for id in ids:
+        course_dir = Path(output_path) / str(id)
+        shutil.rmtree(course_dir / exam, ignore_errors=True)
+        if course_dir.is_dir() and not any(course_dir.iterdir()):
+            course_dir.rmdir()
+
+
+def record_content(manifest: Manifest, exam: str, output_path: Path,
+                   plan: ContentPlan) -> None:
+    """Records the content written for the changed courses of plan and
+    forgets the removed ones."""
+    for id in plan.changed:
+        exam_dir = Path(output_path) / id / exam
+        outputs = sorted(path for path in exam_dir.rglob('*') if path.is_file())
+        manifest.record(f'{exam}/{id}', plan.fingerprints[id], outputs)
+    for id in plan.removed:
+        manifest.remove(f'{exam}/{id}')
+
+
+def partition_data_tables(exam_df: pd.DataFrame, cols: Sequence[str]
+                          ) -> Iterator[tuple[tuple, pd.DataFrame]]:
+    """Yields the (id, ano, modalidade) key and data table of every group.
+
+    The dataset is sorted once by the group columns and by descending
+    nota_final, so each group is a contiguous slice, and the cols shown in
+    the tables are converted to text once for every row. Rows missing any
+    of the group columns belong to no table.
+    """
+    exam_df = exam_df.dropna(subset=PARTITION_COLUMNS)
+    if exam_df.empty:
+        return
+    sorted_df = exam_df.sort_values(PARTITION_COLUMNS + [SORT_COLUMN],
+                                    ascending=[True, True, True, False],
+                                    na_position='last', kind='stable')
+    text_df = sorted_df[list(cols)].astype(str)
+
+    group_codes = sorted_df.groupby(PARTITION_COLUMNS, sort=False).ngroup().to_numpy()
+    starts = np.flatnonzero(np.r_[True, group_codes[1:] != group_codes[:-1]])
+    ends = np.r_[starts[1:], len(group_codes)]
+    keys = sorted_df[PARTITION_COLUMNS].to_numpy()
+    for start, end in zip(starts, ends):
+        yield tuple(keys[start]), text_df.iloc[start:end]
+
+
+def partition_data_tables_by_course(exam_df: pd.DataFrame, cols: Sequence[str]
+                                    ) -> Iterator[tuple[object, list]]:
+    """Groups the tables of partition_data_tables by course id."""
+    tables = partition_data_tables(exam_df, cols)
+    for id, course_tables in groupby(tables, key=lambda table: table[0][0]):
+        yield id, list(course_tables)
+
+
+def table_from_df(df, cols=None, manual_header=None, cells_format=None):
+    if cols is None:
+        cols = df.columns
+
+    if manual_header is not None:
+        header_values = manual_header
+    else:
+        header_values = cols
+
+    data_list = [df[col] for col in cols]
+    fig = go.Figure(data=go.Table(
+        header=dict(values=header_values,
+                    align='center'),
+        cells=dict(values=data_list,
+                   format=cells_format),
+    ))
+    return fig
+
+
+def python_format_spec(d3_format: str) -> str:
+    """Translates a d3 number format, as given to go.Table, to Python.
+
+    d3 ignores the precision of integer types, e.g. '.3d' rounds to an
+    integer, while Python rejects it.
+    """
+    if d3_format.endswith('d'):
+        return d3_format.split('.')[0] + 'd'
+    return d3_format
+
+
+def format_column(values: pd.Series, d3_format: str | None = None) -> list[str]:
+    """Formats the cells of a table column as escaped HTML text.
+
+    Like go.Table, d3_format only applies to numbers, so the cells that do
+    not hold a number, e.g. missing values, are shown as they are.
+    """
+    text = values.astype(str).astype(object)
+    if d3_format is not None:
+        numbers = pd.to_numeric(values, errors='coerce')
+        is_number = numbers.notna()
+        spec = python_format_spec(d3_format)
+        if spec.endswith('d'):
+            numbers = numbers.round()
+            formatted = [format(int(number), spec) for number in numbers[is_number]]
+        else:
+            formatted = [format(number, spec) for number in numbers[is_number]]
+        text[is_number] = formatted
+    return [html.escape(cell) for cell in text]
+
+
+def html_table_from_df(df, cols=None, manual_header=None, cells_format=None) -> str:
+    """Same as table_from_df, but returns a static HTML table.
+
+    The cells are formatted here, so the table needs no JavaScript to be
+    shown and is styled by the Bootstrap classes of the website.
+    """
+    if cols is None:
+        cols = df.columns
+
+    if manual_header is not None:
+        header_values = manual_header
+    else:
+        header_values = cols
+
+    if cells_format is None:
+        cells_format = [None] * len(cols)
+
+    columns = [format_column(df[col], col_format)
+               for col, col_format in zip(cols, cells_format)]
+    header = ''.join(f'<th scope="col">{html.escape(str(value))}</th>'
+                     for value in header_values)
+    rows = ''.join('<tr>' + ''.join(f'<td>{cell}</td>' for cell in cells) + '</tr>\n'
+                   for cells in zip(*columns))
+    return (f'<table class="{HTML_TABLE_CLASS}">\n'
+            f'<thead><tr>{header}</tr></thead>\n'
+            f'<tbody>\n{rows}</tbody>\n'
+            '</table>\n')
+
+
+def write_table(df, cols, manual_header, cells_format, path,
+                backend: str = 'plotly', figure_mode: str = 'fragment') -> None:
+    """Writes the table of df to path with one of TABLE_BACKENDS."""
+    if backend == 'plotly':
+        plotly_fig_to_html(table_from_df(df, cols, manual_header, cells_format),
+                           path, figure_mode)
+    elif backend == 'html':
+        with open(path, 'w', encoding='utf8') as f:
+            f.write(html_table_from_df(df, cols, manual_header, cells_format))
+    else:
+        raise ValueError(f'Unknown table backend {backend}, '
+                         f'expected one of {TABLE_BACKENDS}')
+
+
+def figure_spec_html(fig: go.Figure | dict) -> str:
+    """Returns a div holding the compact JSON spec of fig, without its
+    layout template, to be plotted by the script of figure_page_assets.
+
+    to_json_plotly escapes '<', '>' and '/', so the JSON cannot close the
+    <script> element holding it.
+    """
+    fig_dict = fig if isinstance(fig, dict) else fig.to_dict()
+    fig_dict = {**fig_dict, 'layout': {key: value for key, value in fig_dict['layout'].items()
+                                       if key != 'template'}}
+    return (f'<div class="{FIGURE_SPEC_CLASS}" style="height:100%; width:100%;">'
+            f'<script type="application/json">{to_json_plotly(fig_dict)}</script>'
+            '</div>\n')
+
+
+def figure_page_assets() -> dict[str, str]:
+    """Returns what a page needs once to plot the divs of figure_spec_html:
+    the script loading the Plotly runtime, as write_html loads it from the
+    CDN, and the JSON of the layout template shared by every figure."""
+    integrity = base64.b64encode(
+        hashlib.sha256(get_plotlyjs().encode('utf8')).digest()).decode('ascii')
+    cdn_url = f'https://cdn.plot.ly/plotly-{get_plotlyjs_version()}.min.js'
+    return {
+        'plotly_runtime': (f'<script charset="utf-8" src="{cdn_url}" '
+                           f'integrity="sha256-{integrity}" '
+                           'crossorigin="anonymous"></script>'),
+        'figure_template': to_json_plotly(pio.templates[pio.templates.default]),
+    }
+
+
+def plotly_fig_to_html(fig: go.Figure | dict, path, mode: str = 'fragment'):
+    """Writes fig to path as an HTML fragment.
+
+    In 'fragment' mode the fragment loads the Plotly runtime and plots the
+    figure by itself. In 'page' mode it only holds the figure spec, see
+    figure_spec_html, so pages embedding many figures load the runtime and
+    the layout template once.
+
+    fig may also be the dict of a figure, e.g. from MetricEvolutionFactory,
+    which is written as it is, without validation.
+    """
+    if isinstance(fig, dict):
+        fig['layout'].setdefault('margin', {}).update(FIGURE_MARGIN)
+    else:
+        fig.update_layout(margin=FIGURE_MARGIN)
+    if mode == 'fragment':
+        pio.write_html(fig, path, include_plotlyjs='cdn', full_html=False,
+                       validate=not isinstance(fig, dict))
+    elif mode == 'page':
+        with open(path, 'w', encoding='utf8') as f:
+            f.write(figure_spec_html(fig))
+    else:
+        raise ValueError(f'Unknown figure mode {mode}, '
+                         f'expected one of {FIGURE_MODES}')
+
+
+def abbreviate_quota(plotly_annotation):
+    text = plotly_annotation.text
+    new_text = text
+    for abbreviation in QUOTA_ABBREVIATIONS:
+        if abbreviation in text:
+            new_text = abbreviation
+            break
+
+    return plotly_annotation.update(text=new_text)
+
+
+def plotted_metrics(metrics_df: pd.DataFrame) -> pd.DataFrame:
+    """Selects the METRIC_COLUMNS rows of metrics_df, with nota as NumPy
+    floats, which every Plotly version serializes with missing values as
+    gaps."""
+    return select_metrics(metrics_df, METRIC_COLUMNS).astype({'nota': 'float64'})
+
+
+def metric_evolution_figure(course_metrics_df: pd.DataFrame) -> go.Figure:
+    """Plots the METRIC_COLUMNS of a course, given by its rows of
+    mdv.metrics.compute_metrics, over the years with one row per quota."""
+    molten_df = plotted_metrics(course_metrics_df)
+    fig = px.line(
+        molten_df,
+        x='ano', y='nota',
+        color='metric',
+        facet_row='modalidade',
+        markers=True,
+
+        labels={
+            'ano': 'Ano de ingresso',
+            'nota': '',
+            'metric': 'Valor',
+        },
+        category_orders={
+            'modalidade': QUOTA_ORDER,
+            'metric': ['Máximo', 'Médio', 'Mínimo'],
+        },
+    )
+    first_year = molten_df.ano.min()
+    fig.update_layout(
+        xaxis=dict(
+            tickmode='linear',
+            tick0=first_year,
+            dtick=1,
+            fixedrange=True,
+        ),
+        yaxis=dict(
+            fixedrange=True,
+        ),
+    )
+    fig.for_each_annotation(abbreviate_quota)
+    return fig
+
+
+def quota_key(modalidades: Sequence[str]) -> tuple:
+    """Returns the quotas of a course in the order of the facets of its
+    metric evolution figure: QUOTA_ORDER first, then the other quotas in
+    their order in modalidades."""
+    quotas = list(pd.unique(np.asarray(modalidades, dtype=object)))
+    return tuple(sorted(quotas, key=lambda quota: (QUOTA_ORDER.index(quota)
+                                                   if quota in QUOTA_ORDER
+                                                   else len(QUOTA_ORDER) + quotas.index(quota))))
+
+
+def figure_array(series: pd.Series) -> np.ndarray:
+    """Converts series as the figure validators do: numeric columns with
+    missing values to floats with NaN, other numeric columns to their NumPy
+    dtype and the rest to objects."""
+    if not pd.api.types.is_numeric_dtype(series.dtype):
+        return series.to_numpy(dtype=object)
+    if series.isna().any():
+        return series.to_numpy(dtype='float64', na_value=np.nan)
+    return series.to_numpy(dtype=getattr(series.dtype, 'numpy_dtype', series.dtype))
+
+
+def typed_array_spec(values: np.ndarray) -> dict | np.ndarray:
+    """Encodes values as a plotly.js typed array, as Figure.to_dict does
+    from plotly 6.
+
+    int64 values are stored in the smallest integer dtype holding them.
+    Arrays of other dtypes, or too large integers, are returned as they are.
+    """
+    if values.dtype == np.int64 and values.size > 0:
+        for dtype in ['int8', 'int16', 'int32']:
+            limits = np.iinfo(dtype)
+            if limits.min <= values.min() and values.max() <= limits.max:
+                values = values.astype(dtype)
+                break
+    if values.size == 0 or str(values.dtype) not in TYPED_ARRAY_DTYPES:
+        return values
+    return {'dtype': TYPED_ARRAY_DTYPES[str(values.dtype)],
+            'bdata': base64.b64encode(values).decode('ascii')}
+
+
+def trace_arrays(series: pd.Series, trace_rows: dict[tuple, np.ndarray]) -> dict[tuple, np.ndarray]:
+    """Splits series into the arrays of each trace, converted as the figure
+    validators convert them (see figure_array).
+
+    The dtype of a converted nullable column depends on whether it has
+    missing values, so columns with missing values are converted by trace.
+    """
+    if not series.isna().any():
+        values = figure_array(series)
+        return {group: values[rows] for group, rows in trace_rows.items()}
+    return {group: figure_array(series.iloc[rows])
+            for group, rows in trace_rows.items()}
+
+
+class MetricEvolutionFactory:
+    """Builds the metric evolution figures of an exam without Plotly Express.
+
+    Figures of courses with the same quotas only differ in their trace data
+    and first year. The figure of each set of quotas is built once with
+    px.line, from a single row per trace whose nota tells which trace it is,
+    and kept as a dict. The figure of each course is a copy of that dict
+    with its traces' x and y swapped for the course's, which gives the same
+    figure as metric_evolution_figure many times faster.
+    """
+
+    def __init__(self, metrics_df: pd.DataFrame | None = None):
+        """Builds the figures of the quotas of every course of metrics_df,
+        from mdv.metrics.compute_metrics, so that copies of the factory, e.g.
+        in other processes, do not build them again."""
+        self._templates: dict[tuple, tuple[dict, list[tuple]]] = {}
+        if metrics_df is not None:
+            seen_keys = set()
+            for _, molten_df in plotted_metrics(metrics_df).groupby('id'):
+                key = quota_key(molten_df['modalidade'])
+                if key not in seen_keys:
+                    seen_keys.add(key)
+                    self._template(molten_df)
+
+    def _template(self, molten_df: pd.DataFrame) -> tuple[dict, list[tuple]]:
+        """Returns the figure dict of the quotas of molten_df and the
+        (metric, modalidade) of each of its traces."""
+        key = (quota_key(molten_df['modalidade']), tuple(molten_df.dtypes.astype(str)))
+        if key not in self._templates:
+            probe_df = molten_df.drop_duplicates(['metric', 'modalidade']).reset_index(drop=True)
+            groups = list(zip(probe_df['metric'], probe_df['modalidade']))
+            # Keeps the dtype of nota, which decides the trace orientation
+            probe_df['nota'] = pd.Series(np.arange(len(probe_df)), dtype=float).astype(
+                probe_df['nota'].dtype)
+            fig = metric_evolution_figure(probe_df)
+            trace_groups = [groups[int(trace.y[0])] for trace in fig.data]
+            self._templates[key] = fig.to_dict(), trace_groups
+        return self._templates[key]
+
+    def figure_dict(self, course_metrics_df: pd.DataFrame) -> dict:
+        """Same as metric_evolution_figure(course_metrics_df).to_dict()."""
+        molten_df = plotted_metrics(course_metrics_df)
+        template, trace_groups = self._template(molten_df)
+        # The layout template is large and the same for every figure, so it
+        # is shared instead of copied
+        data = deepcopy(template['data'])
+        layout = {key: value if key == 'template' else deepcopy(value)
+                  for key, value in template['layout'].items()}
+
+        trace_rows = molten_df.groupby(['metric', 'modalidade'], sort=False).indices
+        x = trace_arrays(molten_df['ano'], trace_rows)
+        y = trace_arrays(molten_df['nota'], trace_rows)
+        for trace, group in zip(data, trace_groups):
+            trace['x'] = x[group]
+            trace['y'] = y[group]
+            if ENCODES_TYPED_ARRAYS:
+                trace['x'] = typed_array_spec(trace['x'])
+                trace['y'] = typed_array_spec(trace['y'])
+        layout['xaxis']['tick0'] = molten_df.ano.min()
+        return {'data': data, 'layout': layout}
+
+    def figure(self, course_metrics_df: pd.DataFrame) -> go.Figure:
+        return go.Figure(self.figure_dict(course_metrics_df))
+
+
+def latest_metrics_table(course_latest_df: pd.DataFrame) -> go.Figure:
+    """Tabulates the metrics of the latest year of a course, given by its
+    rows of mdv.metrics.latest_metrics."""
+    return table_from_df(course_latest_df,
+                         LATEST_METRICS_COLUMNS,
+                         LATEST_METRICS_HEADER,
+                         LATEST_METRICS_FORMATS)
+
+
+def write_metric_evolution(id, course_metrics_df: pd.DataFrame,
+                           exam: str, output_path: Path,
+                           figure_mode: str = 'fragment',
+                           factory: MetricEvolutionFactory | None = None) -> None:
+    if factory is None:
+        fig = metric_evolution_figure(course_metrics_df)
+    else:
+        fig = factory.figure_dict(course_metrics_df)
+    plotly_fig_to_html(fig,
+                       os.path.join(output_path, str(id), exam,
+                                    'metric_evolution.html'),
+                       figure_mode)
+
+
+def write_latest_metrics_table(id, course_latest_df: pd.DataFrame,
+                               exam: str, output_path: Path,
+                               backend: str = 'plotly',
+                               figure_mode: str = 'fragment') -> None:
+    write_table(course_latest_df,
+                LATEST_METRICS_COLUMNS,
+                LATEST_METRICS_HEADER,
+                LATEST_METRICS_FORMATS,
+                os.path.join(output_path, str(id), exam, 'latest_metrics.html'),
+                backend, figure_mode)
+
+
+def write_data_tables(id, course_tables: list, cols, header, cells_format,
+                      exam: str, output_path: Path,
+                      backend: str = 'plotly',
+                      figure_mode: str = 'fragment') -> None:
+    """Writes the tables of a course given by partition_data_tables_by_course."""
+    for (id, ano, modalidade), table_df in course_tables:
+        write_table(table_df, cols, header, cells_format,
+                    os.path.join(output_path, str(id), exam,
+                                 str(ano), f'{modalidade}.html'),
+                    backend, figure_mode)
+
+
+# Arguments shared by every course, set once in each process of run_by_course
+_shared_args: tuple = ()
+
+
+def _set_shared_args(*shared_args) -> None:
+    global _shared_args
+    _shared_args = shared_args
+
+
+def _call_with_shared_args(func: Callable, *args):
+    return func(*args, *_shared_args)
+
+
+def run_by_course(func: Callable, course_args: Iterable[tuple],
+                  workers: int = 1, shared_args: tuple = ()) -> list:
+    """Calls func(*args, *shared_args) for the arguments of every course,
+    spreading the courses over workers processes.
+
+    Each process only receives the arguments of its courses, so pass each
+    course its own slice of the data rather than whole datasets. Arguments
+    needed by every course, such as a MetricEvolutionFactory, go in
+    shared_args, which are sent to each process once when it starts rather
+    than with every course.
+    """
+    course_args = list(course_args)
+    if workers <= 1 or len(course_args) <= 1:
+        return [func(*args, *shared_args) for args in course_args]
+    with ProcessPoolExecutor(max_workers=workers, initializer=_set_shared_args,
+                             initargs=shared_args) as executor:
+        return list(executor.map(_call_with_shared_args, repeat(func),
+                                 *zip(*course_args)))
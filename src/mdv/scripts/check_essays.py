@@ -0,0 +1,59 @@
+"""Parses the essay information of every table in 2_intermediate/forms as
+stage b does, and lists the answers whose values do not fit EssaySchemas.
+
+Exits with an error if any table cannot be parsed. Values that do not fit
+the schema are kept by stage b and only reported here, for manual review.
+
+Run with `python -m mdv.scripts.check_essays` from src/, or `make check`.
+"""
+import sys
+
+import pandas as pd
+
+from mdv.config import DataDirectories, EssaySchemas, Exams
+from mdv.essays import parse_essay_forms
+from mdv.storage import list_tables, read_table
+
+INPUT_PATH = DataDirectories.TWO.value / 'forms'
+
+
+def misfit_values(essays_df: pd.DataFrame, exam_name: str) -> pd.DataFrame:
+    """Returns the (column, value) of every schema column of the parsed
+    essays_df whose values could not be cast, indexed by row."""
+    parsed_df = parse_essay_forms(essays_df, exam_name)
+    misfits = []
+    for field in EssaySchemas[exam_name.upper()].value:
+        column = parsed_df[field.target]
+        if column.dtype == field.dtype:
+            continue
+        values = column.dropna()
+        if field.dtype in ('Int64', 'Float64'):
+            values = values.loc[pd.to_numeric(values, errors='coerce').isna()]
+        misfits.append(pd.DataFrame({'column': field.target, 'value': values}))
+    if not misfits:
+        return pd.DataFrame(columns=['column', 'value'])
+    return pd.concat(misfits)
+
+
+def main() -> int:
+    failed = False
+    for exam in Exams:
+        exam_name = exam.name.lower()
+        for table_path in list_tables(INPUT_PATH / exam_name):
+            form_df = read_table(table_path)
+            essays_df = form_df.loc[form_df['redacao'].notna()]
+            try:
+                misfits_df = misfit_values(essays_df, exam_name)
+            except (ValueError, TypeError) as error:
+                print(f'{exam_name}/{table_path.stem}: {error}')
+                failed = True
+                continue
+            print(f'{exam_name}/{table_path.stem}: {len(essays_df)} essays, '
+                  f'{len(misfits_df)} values not fitting the schema')
+            if not misfits_df.empty:
+                print(misfits_df.to_string())
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,12 +1,19 @@
 import os
 import sys
 
-sys.stdout = open(os.devnull, 'w')
-try:
-    from mdv.notebooks import a_parse_forms
-    # from mdv.notebooks import b_parse_essays
-except:
-    raise Exception('Execution failed')
-finally:
-    sys.stdout.close()
-    sys.stdout = sys.__stdout__
+# Worker processes may import this module again, see a_parse_forms
+if __name__ == '__main__':
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        from mdv.notebooks import a_parse_forms
+        forms_report = a_parse_forms.main()
+        # from mdv.notebooks import b_parse_essays
+        # b_parse_essays.main()
+    except:
+        raise Exception('Execution failed')
+    finally:
+        sys.stdout.close()
+        sys.stdout = sys.__stdout__
+    if forms_report.skipped:
+        print('Skipped forms unchanged since the last run: '
+              + ', '.join(forms_report.skipped))
@@ -0,0 +1,241 @@
+from pathlib import Path
+from typing import Iterator
+import json
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from mdv.config import StorageConfig
+
+SUFFIXES = {
+    'parquet': '.parquet',
+    'feather': '.feather',
+    'csv': '.csv',
+}
+
+
+def storage_format_of(path: Path) -> str:
+    for storage_format, suffix in SUFFIXES.items():
+        if Path(path).suffix == suffix:
+            return storage_format
+    raise ValueError(f'Unknown storage format for {path}')
+
+
+def table_path(path: Path, storage_format: str | None = None) -> Path:
+    """Returns path with the suffix of storage_format.
+
+    Defaults to StorageConfig.FORMAT, so callers may pass stage paths with
+    or without a suffix, e.g. 4_final/forms/enem or .../enem.csv.
+    """
+    if storage_format is None:
+        storage_format = StorageConfig.FORMAT.value
+    if storage_format not in SUFFIXES:
+        raise ValueError(f'Unknown storage format {storage_format}')
+    path = Path(path)
+    if path.suffix in SUFFIXES.values():
+        path = path.with_suffix('')
+    return path.with_name(path.name + SUFFIXES[storage_format])
+
+
+def find_table(path: Path) -> Path:
+    """Returns the existing file for path, preferring StorageConfig.FORMAT
+    and then the order of SUFFIXES.
+
+    Writing a table removes it in the other formats (see TableWriter), so
+    several formats only coexist when copied in by hand.
+    """
+    candidates = [table_path(path)]
+    candidates += [table_path(path, storage_format) for storage_format in SUFFIXES]
+    for candidate in candidates:
+        if candidate.exists():
+            return candidate
+    raise FileNotFoundError(f'No table found for {path}')
+
+
+def list_tables(directory: Path) -> list[Path]:
+    """Lists the tables in directory, one per name, sorted by name."""
+    stems = sorted({path.stem for path in Path(directory).iterdir()
+                    if path.suffix in SUFFIXES.values()})
+    return [find_table(Path(directory) / stem) for stem in stems]
+
+
+def read_table(path: Path) -> pd.DataFrame:
+    """Reads a table stored in any supported format.
+
+    CSV columns are converted to nullable dtypes, as they are stored as
+    text; columnar formats keep the dtypes they were written with.
+    """
+    path = find_table(path)
+    storage_format = storage_format_of(path)
+    if storage_format == 'parquet':
+        return pd.read_parquet(path)
+    elif storage_format == 'feather':
+        return pd.read_feather(path)
+    else:
+        return pd.read_csv(path).convert_dtypes()
+
+
+def read_table_columns(path: Path) -> list[str]:
+    """Reads only the column names of a table."""
+    path = find_table(path)
+    storage_format = storage_format_of(path)
+    if storage_format == 'parquet':
+        return pq.read_schema(path).names
+    elif storage_format == 'feather':
+        with pa.memory_map(str(path)) as source:
+            return pa.ipc.open_file(source).schema.names
+    else:
+        return list(pd.read_csv(path, nrows=0).columns)
+
+
+def count_rows(path: Path) -> int:
+    """Counts the rows of a table, from the metadata of columnar formats."""
+    path = find_table(path)
+    storage_format = storage_format_of(path)
+    if storage_format == 'parquet':
+        return pq.ParquetFile(path).metadata.num_rows
+    elif storage_format == 'feather':
+        with pa.memory_map(str(path)) as source:
+            return pa.ipc.open_file(source).read_all().num_rows
+    else:
+        return len(pd.read_csv(path, usecols=[0]))
+
+
+def iter_table_chunks(path: Path, chunksize: int) -> Iterator[pd.DataFrame]:
+    """Reads a table chunksize rows at a time."""
+    path = find_table(path)
+    storage_format = storage_format_of(path)
+    if storage_format == 'parquet':
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize):
+            yield batch.to_pandas()
+    elif storage_format == 'feather':
+        df = pd.read_feather(path)
+        for start in range(0, len(df), chunksize):
+            yield df.iloc[start:start+chunksize]
+    else:
+        for chunk_df in pd.read_csv(path, chunksize=chunksize):
+            yield chunk_df.convert_dtypes()
+
+
+def write_table(df: pd.DataFrame, path: Path,
+                storage_format: str | None = None) -> Path:
+    """Writes df to path in storage_format and returns the written path."""
+    with TableWriter(path, storage_format) as writer:
+        writer.write(df)
+    return writer.path
+
+
+def can_cast(array: pa.ChunkedArray, target_type: pa.DataType) -> bool:
+    try:
+        array.cast(target_type)
+    except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+        return False
+    return True
+
+
+def is_numeric(data_type: pa.DataType) -> bool:
+    return pa.types.is_integer(data_type) or pa.types.is_floating(data_type)
+
+
+def widen_schema(schema: pa.Schema, table: pa.Table) -> pa.Schema:
+    """Returns schema widened so that table can be cast to it.
+
+    Conflicting numeric columns become floats and any other conflicting
+    column becomes a string column. Columns with no type yet, i.e. entirely
+    empty ones, become strings as well. The pandas metadata is updated so the
+    table is read back with matching dtypes.
+    """
+    pandas_metadata = json.loads(schema.metadata[b'pandas'])
+    column_metadata = {column['name']: column
+                       for column in pandas_metadata['columns']}
+    for index, field in enumerate(schema):
+        if not pa.types.is_null(field.type):
+            if can_cast(table.column(field.name), field.type):
+                continue
+        if is_numeric(field.type) and is_numeric(table.column(field.name).type):
+            is_nullable = column_metadata[field.name]['numpy_type'][0].isupper()
+            new_type = pa.float64()
+            column_metadata[field.name].update(
+                pandas_type='float64',
+                numpy_type='Float64' if is_nullable else 'float64')
+        else:
+            new_type = pa.string()
+            column_metadata[field.name].update(
+                pandas_type='unicode', numpy_type='string', metadata=None)
+        schema = schema.set(index, pa.field(field.name, new_type))
+    return schema.with_metadata({b'pandas': json.dumps(pandas_metadata)})
+
+
+class TableWriter:
+    """Writes a table one chunk at a time.
+
+    Parquet chunks are cast to the schema of the first chunk. When a later
+    chunk cannot be cast to it, the schema is widened (see widen_schema) and
+    the rows already written are rewritten with it. Feather files cannot be
+    appended to, so they only accept a single chunk.
+
+    Once the first chunk is written, the table is removed in the other
+    formats, so an older copy cannot be read instead of it.
+    """
+
+    def __init__(self, path: Path, storage_format: str | None = None):
+        self.path = table_path(path, storage_format)
+        self.storage_format = storage_format_of(self.path)
+        self.chunks_written = 0
+        self._parquet_writer = None
+
+    def write(self, df: pd.DataFrame) -> None:
+        if self.storage_format == 'parquet':
+            self._write_parquet(df)
+        elif self.storage_format == 'feather':
+            if self.chunks_written > 0:
+                raise ValueError('Feather tables cannot be written in chunks')
+            df.reset_index(drop=True).to_feather(self.path)
+        else:
+            is_first_chunk = self.chunks_written == 0
+            df.to_csv(self.path, index=False,
+                      mode='w' if is_first_chunk else 'a',
+                      header=is_first_chunk)
+        if self.chunks_written == 0:
+            self._remove_other_formats()
+        self.chunks_written += 1
+
+    def _remove_other_formats(self) -> None:
+        for storage_format in SUFFIXES:
+            other_path = table_path(self.path, storage_format)
+            if other_path != self.path and other_path.exists():
+                other_path.unlink()
+
+    def _write_parquet(self, df: pd.DataFrame) -> None:
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        if self._parquet_writer is None:
+            schema = widen_schema(table.schema, table)
+            self._parquet_writer = pq.ParquetWriter(self.path, schema)
+
+        schema = widen_schema(self._parquet_writer.schema, table)
+        if not schema.equals(self._parquet_writer.schema, check_metadata=True):
+            self._rewrite_parquet(schema)
+        self._parquet_writer.write_table(table.select(schema.names).cast(schema))
+
+    def _rewrite_parquet(self, schema: pa.Schema) -> None:
+        """Rewrites the row groups written so far with a wider schema."""
+        self._parquet_writer.close()
+        previous_path = self.path.with_name(self.path.name + '.tmp')
+        self.path.replace(previous_path)
+        self._parquet_writer = pq.ParquetWriter(self.path, schema)
+        for batch in pq.ParquetFile(previous_path).iter_batches():
+            table = pa.Table.from_batches([batch])
+            self._parquet_writer.write_table(table.cast(schema))
+        previous_path.unlink()
+
+    def close(self) -> None:
+        if self._parquet_writer is not None:
+            self._parquet_writer.close()
+            self._parquet_writer = None
+
+    def __enter__(self) -> 'TableWriter':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
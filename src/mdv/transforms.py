@@ -0,0 +1,50 @@
+from typing import Iterable
+
+import numpy as np
+import pandas as pd
+
+from mdv.config import Field
+
+
+def coalesce_columns(df: pd.DataFrame, col_regex: str) -> pd.Series:
+    """Merges the columns matching col_regex into a single series.
+
+    Forms split a single question (e.g. Unidade or Curso) across several
+    columns, only one of which is filled per response. For each row, the
+    last non-null value among the selected columns is kept, or NaN if all
+    of them are null.
+    """
+    selected_col_df = df.filter(regex=col_regex)
+    values = selected_col_df.to_numpy(dtype=object)
+    if values.shape[1] == 0:
+        return pd.Series(np.nan, index=df.index, dtype=object)
+
+    not_null = pd.notna(values)
+    reversed_last_index = np.argmax(not_null[:, ::-1], axis=1)
+    last_index = values.shape[1] - 1 - reversed_last_index
+    rows = np.arange(values.shape[0])
+    merged_values = values[rows, last_index]
+    merged_values[~not_null.any(axis=1)] = np.nan
+
+    return pd.Series(merged_values, index=df.index, dtype=object)
+
+
+def apply_schema(df: pd.DataFrame, schema: Iterable[Field],
+                 errors: str = 'raise') -> pd.DataFrame:
+    """Selects, renames and casts the columns of df according to schema.
+
+    Columns whose source is absent are filled with the field default. With
+    errors='ignore', columns that cannot be cast keep their original dtype,
+    which is useful for raw form answers that are reviewed manually later.
+    """
+    schema = tuple(schema)
+    columns = {}
+    for field in schema:
+        if field.source is not None and field.source in df.columns:
+            columns[field.target] = df[field.source]
+        else:
+            columns[field.target] = pd.Series(field.default, index=df.index,
+                                              dtype=object)
+    schema_df = pd.DataFrame(columns, index=df.index)
+    dtypes = {field.target: field.dtype for field in schema}
+    return schema_df.astype(dtypes, errors=errors)